@@ -1,9 +1,27 @@
 #include <math.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
-#include <time.h>
+
+// bytes allocated by the kernels since the library was loaded, read by the generation
+// loop's observers to report the memory each stage asks of the C side
+static size_t allocated_bytes = 0;
+
+size_t kernel_allocated_bytes() {
+    return allocated_bytes;
+}
+
+void * kernel_malloc(size_t bytes) {
+    allocated_bytes += bytes;
+    return malloc(bytes);
+}
+
+void * kernel_calloc(size_t count, size_t bytes) {
+    allocated_bytes += count * bytes;
+    return calloc(count, bytes);
+}
 
 void print_individual(int * pixels, size_t size) {
     for (int i = 0; i < size*3; i+=3) {
@@ -27,95 +45,129 @@ float evaluate_fitness(int * ind_pixels, int * orig_pixels, double goal, size_t
     return fitness;
 }
 
-// random int generator used because c rand() does not generate large numbers
-int xorshift32(int seed) {
-    int x = seed;
-    x ^= (x << 13);
-    x ^= (x >> 17);
-    x ^= (x << 5);
-    return abs(x);
+// number of pixels of an individual equal to the original pixel at the same position
+int count_matches(int * ind_pixels, int * orig_pixels, size_t size) {
+    int matches = 0;
+    for (int i = 0; i < size*3; i+=3) {
+        if (ind_pixels[i] == orig_pixels[i] && ind_pixels[i+1] == orig_pixels[i+1] && ind_pixels[i+2] == orig_pixels[i+2])
+            matches++;
+    }
+    return matches;
 }
 
-int* mass_swap(int * pixels, int seed, size_t size) {
-    int ** swapped_pixels = (int**) malloc(size * sizeof(int*));
-    for (int i = 0, p = 0; i < size*3; i+=3, p++) {
-        swapped_pixels[p] = (int*) malloc(3 * sizeof(int));
-        for (int k = 0; k < 3; k++) swapped_pixels[p][k] = pixels[i+k];
-    }
-    
-    int num_swaps = xorshift32(seed) % size;
-    int reuse_seed = xorshift32(num_swaps) % size;
+// counts the matching pixels of num_inds individuals stored back to back in population
+void batch_count_matches(int * population, int * orig_pixels, int * matches, size_t num_inds, size_t size) {
+    for (size_t k = 0; k < num_inds; k++)
+        matches[k] = count_matches(population + k*size*3, orig_pixels, size);
+}
 
-    for (int i = 0; i < num_swaps; i++) {
-        reuse_seed = xorshift32(reuse_seed | rand());
-        int pos1 = reuse_seed % size;
-        reuse_seed = xorshift32(reuse_seed | rand());
-        int pos2 = reuse_seed % size;
-
-        int * tmp = swapped_pixels[pos1];
-        swapped_pixels[pos1] = swapped_pixels[pos2];
-        swapped_pixels[pos2] = tmp;
-    }
+// 1 if pixel is equal to the original pixel at pos
+int pixel_matches(int * pixel, int * orig_pixels, int pos) {
+    return pixel[0] == orig_pixels[pos*3] && pixel[1] == orig_pixels[pos*3+1] && pixel[2] == orig_pixels[pos*3+2];
+}
 
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++)
-            flattened[i] = swapped_pixels[j][p];
-        free(swapped_pixels[j]);
-    }
-    free(swapped_pixels);
+// counter-based random streams (splitmix64). the n-th number of the stream with key k
+// is mix64(k + n * gamma), so a stream has no state besides its counter and every kernel
+// call draws from its own stream, keyed by the caller, without touching global state
+#define GOLDEN_GAMMA 0x9E3779B97F4A7C15ULL
 
-    return flattened;
+typedef struct {
+    uint64_t key;
+    uint64_t counter;
+} rng_stream;
+
+uint64_t mix64(uint64_t z) {
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
 }
 
-int* smart_swap(int * pixels, int seed, int max_swap, size_t size) {
-    int ** swapped_pixels = (int**) malloc(size * sizeof(int*));
-    for (int i = 0, p = 0; i < size*3; i+=3, p++) {
-        swapped_pixels[p] = (int*) malloc(3 * sizeof(int));
-        for (int k = 0; k < 3; k++) swapped_pixels[p][k] = pixels[i+k];
-    }
-    
-    int num_swaps = xorshift32(seed) % max_swap;
-    int reuse_seed = xorshift32(num_swaps) % size;
+// key of the independent sub-stream id of key, e.g. a worker of a seed or a call of a worker
+uint64_t stream_key(uint64_t key, uint64_t id) {
+    return mix64(key ^ mix64((id + 1) * GOLDEN_GAMMA));
+}
+
+uint64_t next_random(rng_stream * stream) {
+    return mix64(stream->key + ++stream->counter * GOLDEN_GAMMA);
+}
+
+// random number in [0, bound)
+size_t random_below(rng_stream * stream, size_t bound) {
+    return next_random(stream) % bound;
+}
+
+// times a swap of two pixels of the same color is redrawn by swap_pixels
+#define MAX_REDRAWS 32
+
+// number of swaps of a mutation: a random number of draws below bound, of which only the
+// share swap_share (the chance that two random pixels differ in color, computed by the caller
+// from the color class index) would change the image. the same-color draws are skipped
+// instead of performed, so the mutation keeps its strength without their work
+int effective_swaps(rng_stream * stream, size_t bound, double swap_share) {
+    return (int) (random_below(stream, bound) * swap_share + .5);
+}
+
+// 1 if the pixels at pos1 and pos2 of an rgb individual have the same color
+int same_color(int * pixels, size_t pos1, size_t pos2) {
+    return pixels[pos1*3] == pixels[pos2*3] && pixels[pos1*3+1] == pixels[pos2*3+1] && pixels[pos1*3+2] == pixels[pos2*3+2];
+}
 
+// swaps num_swaps random pixels of child in place. matches is the number of matching
+// pixels before the swaps and is updated by only checking the swapped positions
+int swap_pixels(int * child, int * orig_pixels, int matches, int num_swaps, rng_stream * stream, size_t size) {
     for (int i = 0; i < num_swaps; i++) {
-        reuse_seed = xorshift32(reuse_seed | rand());
-        int pos1 = reuse_seed % size;
-        reuse_seed = xorshift32(reuse_seed | rand());
-        int pos2 = reuse_seed % size;
-
-        int * tmp = swapped_pixels[pos1];
-        swapped_pixels[pos1] = swapped_pixels[pos2];
-        swapped_pixels[pos2] = tmp;
+        size_t pos1 = random_below(stream, size);
+        size_t pos2 = random_below(stream, size);
+        // redraw (a bounded number of times) swaps of two pixels of the same color, they
+        // leave the image unchanged
+        for (int tries = 0; tries < MAX_REDRAWS && same_color(child, pos1, pos2); tries++)
+            pos2 = random_below(stream, size);
+
+        if (same_color(child, pos1, pos2)) continue;
+        matches -= pixel_matches(child + pos1*3, orig_pixels, pos1) + pixel_matches(child + pos2*3, orig_pixels, pos2);
+        for (int k = 0; k < 3; k++) {
+            int tmp = child[pos1*3+k];
+            child[pos1*3+k] = child[pos2*3+k];
+            child[pos2*3+k] = tmp;
+        }
+        matches += pixel_matches(child + pos1*3, orig_pixels, pos1) + pixel_matches(child + pos2*3, orig_pixels, pos2);
     }
+    return matches;
+}
 
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++)
-            flattened[i] = swapped_pixels[j][p];
-        free(swapped_pixels[j]);
-    }
-    free(swapped_pixels);
+// writes the mutated copy of pixels into the caller's child buffer (child may be pixels
+// itself to mutate in place). returns the number of matching pixels of child given the
+// matches of pixels
+int mass_swap(int * pixels, int * child, int * orig_pixels, int matches, uint64_t key, double swap_share, size_t size) {
+    rng_stream stream = {key, 0};
+    if (child != pixels) memcpy(child, pixels, size*3*sizeof(int));
+    return swap_pixels(child, orig_pixels, matches, effective_swaps(&stream, size, swap_share), &stream, size);
+}
 
-    return flattened;
+int smart_swap(int * pixels, int * child, int * orig_pixels, int matches, uint64_t key, int max_swap, double swap_share, size_t size) {
+    rng_stream stream = {key, 0};
+    if (child != pixels) memcpy(child, pixels, size*3*sizeof(int));
+    if (max_swap < 1) max_swap = 1;
+    return swap_pixels(child, orig_pixels, matches, effective_swaps(&stream, max_swap, swap_share), &stream, size);
 }
 
 // returns position of tournament winner
-int tournament_select(float * fitness, int opps, size_t size) {
-    int winner = rand() % size;
+int tournament_select(float * fitness, int opps, uint64_t key, size_t size) {
+    rng_stream stream = {key, 0};
+    int winner = random_below(&stream, size);
     for (int k = 0; k < opps-1; k++) {
-        int opp = rand() % size;
+        int opp = random_below(&stream, size);
         if (fitness[winner] < fitness[opp])
-            winner = rand() % 11 <= 8 ? winner : opp;
+            winner = random_below(&stream, 11) <= 8 ? winner : opp;
         else if (fitness[winner] == fitness[opp])
-            winner = rand() % 2 == 0 ? winner : opp;
+            winner = random_below(&stream, 2) == 0 ? winner : opp;
         else
-            winner = rand() % 11 <= 2 ? winner : opp;
+            winner = random_below(&stream, 11) <= 2 ? winner : opp;
     } 
     return winner;
 }
 
-// used in crossovers and greedy
+// used in the alternate greedy_generate
 int find_pixel_ptr(int ** parent, int * pixel, int start, int end) {
     for (int i = start; i < end; i++) {
         if (parent[i] == pixel) return i;
@@ -123,186 +175,6 @@ int find_pixel_ptr(int ** parent, int * pixel, int start, int end) {
     return -1;
 }
 
-int* pmx_cross(int * parent1, int * parent2, size_t size) {
-    int ** p_1 = (int**) malloc(size * sizeof(int*));
-    int ** p_2 = (int**) malloc(size * sizeof(int*));
-    int ** child = (int**) malloc(size * sizeof(int*));
-
-    // helps keep track of which pixels have been copied
-    bool copied[size];
-
-    for (int i = 0; i < size; i++) {
-        p_1[i] = (int*) malloc(3 * sizeof(int));
-        p_2[i] = (int*) malloc(3 * sizeof(int));
-        child[i] = (int*) malloc(3 * sizeof(int));
-        for (int p = 0; p < 3; p++) {
-            p_1[i][p] = parent1[i*3+p];
-            p_2[i][p] = parent2[i*3+p];
-        }
-    }
-    int pos1 = xorshift32(rand()) % size;
-    int pos2 = xorshift32(rand()) % size;
-    while (pos1 == pos2) pos2 = xorshift32(rand()) % size;
-    if (pos1 > pos2) {
-        int tmp = pos1;
-        pos1 = pos2;
-        pos2 = pos1;
-    }
-    // copy random segment from P1 to child
-    for (int i = pos1; i <= pos2; i++) {
-        child[i] = p_1[i];
-        copied[i] = true;
-    }
-    // may have issue with duplicates. if so in find_pixel_ptr compare address of pixel
-    for (int i = pos1; i <= pos2; i++) {
-        int child_pos = find_pixel_ptr(child, p_2[i], 0, size);
-        if (child_pos != -1) {
-            child_pos = find_pixel_ptr(p_2, p_1[i], 0, size);
-            while (pos1 <= child_pos && child_pos <= pos2) 
-                child_pos = find_pixel_ptr(p_2, p_1[child_pos], 0, size);
-            child[child_pos] = p_1[i];
-            copied[i] = true;
-        }
-    }
-
-    for (int i = 0; i < size; i++) {
-        if (!copied[i]) child[i] = p_2[i];
-    }
-
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++) flattened[i] = child[j][p];
-        free(child[j]);
-    }
-    
-    free(child);
-    return flattened;
-}
-
-// pmx cross has range limit
-int* smart_pmx_cross(int * parent1, int * parent2, size_t size, size_t max_cross) {
-    int ** p_1 = (int**) malloc(size * sizeof(int*));
-    int ** p_2 = (int**) malloc(size * sizeof(int*));
-    int ** child = (int**) malloc(size * sizeof(int*));
-
-    // helps keep track of which pixels have been copied
-    bool copied[size];
-
-    for (int i = 0; i < size; i++) {
-        p_1[i] = (int*) malloc(3 * sizeof(int));
-        p_2[i] = (int*) malloc(3 * sizeof(int));
-        child[i] = (int*) malloc(3 * sizeof(int));
-        for (int p = 0; p < 3; p++) {
-            p_1[i][p] = parent1[i*3+p];
-            p_2[i][p] = parent2[i*3+p];
-        }
-    }
-    int pos1 = xorshift32(rand()) % size;
-    int pos2 = xorshift32(rand()) % size;
-
-    while(abs(pos1-pos2) >= max_cross || pos1 == pos2) pos2 = xorshift32(rand()) % size;
-
-    if (pos1 > pos2) {
-        int tmp = pos1;
-        pos1 = pos2;
-        pos2 = pos1;
-    }
-    // copy random segment from P1 to child
-    for (int i = pos1; i <= pos2; i++) {
-        child[i] = p_1[i];
-        copied[i] = true;
-    }
-    for (int i = pos1; i <= pos2; i++) {
-        int child_pos = find_pixel_ptr(child, p_2[i], 0, size);
-        if (child_pos != -1) {
-            child_pos = find_pixel_ptr(p_2, p_1[i], 0, size);
-            while (pos1 <= child_pos && child_pos <= pos2) 
-                child_pos = find_pixel_ptr(p_2, p_1[child_pos], 0, size);
-            child[child_pos] = p_1[i];
-            copied[i] = true;
-        }
-    }
-
-    for (int i = 0; i < size; i++) {
-        if (!copied[i]) child[i] = p_2[i];
-    }
-
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++) flattened[i] = child[j][p];
-        free(child[j]);
-    }
-    
-    free(child);
-    return flattened;
-}
-
-int* order_cross(int * parent1, int * parent2, size_t size) {
-    int ** p_1 = (int**) malloc(size * sizeof(int*));
-    int ** p_2 = (int**) malloc(size * sizeof(int*));
-    int ** child = (int**) malloc(size * sizeof(int*));
-
-    // helps keep track of which pixels have been copied
-    bool copied[size];
-
-    for (int i = 0; i < size; i++) {
-        p_1[i] = (int*) malloc(3 * sizeof(int));
-        p_2[i] = (int*) malloc(3 * sizeof(int));
-        child[i] = (int*) malloc(3 * sizeof(int));
-        for (int p = 0; p < 3; p++) {
-            p_1[i][p] = parent1[i*3+p];
-            p_2[i][p] = parent2[i*3+p];
-        }
-    }
-    int pos1 = xorshift32(rand()) % size;
-    int pos2 = xorshift32(rand()) % size;
-
-    while(pos1 == pos2) pos2 = xorshift32(rand()) % size;
-    
-    if (pos1 > pos2) {
-        int tmp = pos1;
-        pos1 = pos2;
-        pos2 = pos1;
-    }
-
-    // copy random segment from P1 to child
-    for (int i = pos1; i <= pos2; i++) child[i] = p_1[i];
-
-    // copy rest from second parent in order
-    int p2_iter = pos2+1;
-    int child_iter = p2_iter;
-
-    for (; p2_iter < size && child_iter < size; p2_iter++) {
-        if (find_pixel_ptr(child, p_2[p2_iter], pos1, pos2) == -1) {
-            child[child_iter] = p_2[p2_iter];
-            child_iter++;
-        }
-    }
-    p2_iter = 0;
-    for (; child_iter < size; p2_iter++) {
-        if (find_pixel_ptr(child, p_2[p2_iter], pos1, pos2) == -1) {
-            child[child_iter] = p_2[p2_iter];
-            child_iter++;
-        }
-    }
-    child_iter = 0;
-    for (; child_iter < pos1; p2_iter++) {
-        if (find_pixel_ptr(child, p_2[p2_iter], pos1, pos2) == -1) {
-            child[child_iter] = p_2[p2_iter];
-            child_iter++;
-        }
-    }
-
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++) flattened[i] = child[j][p];
-        free(child[j]);
-    }
-    
-    free(child);
-    return flattened;
-}
-
 // should be better but has similar result. also much much slower
 // however may prevent pixel loss
 /* int* greedy_generate(int * original, double goal, int seed, size_t size) {
@@ -359,40 +231,186 @@ int* order_cross(int * parent1, int * parent2, size_t size) {
 } */
 
 // working version
-int* greedy_generate(int * original, double goal, int seed, size_t size) {
-    srand(time(NULL));
-    int ** gsol = (int**) malloc(size * sizeof(int*));
-    int * match = (int*) malloc(size * sizeof(int));
-    int * unused = (int*) malloc(size * sizeof(int));
-    for (int i = 0; i < size; i++) {
-        gsol[i] = (int*) malloc(3 * sizeof(int));
-        unused[i] = i;
-        for (int p = 0; p < 3; p++) gsol[i][p] = original[i*3+p];
-    }
-    int reuse_seed = xorshift32(seed) % size;
-    int match_len  = 0;
+// writes the greedy solution into the caller's gsol buffer
+void greedy_generate(int * original, int * gsol, double goal, uint64_t key, size_t size) {
+    rng_stream stream = {key, 0};
+    int * unused = (int*) kernel_malloc(size * sizeof(int));
+    memcpy(gsol, original, size*3*sizeof(int));
+    for (int i = 0; i < size; i++) unused[i] = i;
     int unused_len = size;
     for (int i = 0; i < size; i++) {
         int pos = i;
-        if (rand() % 101 <= goal) match[match_len++] = i;
-        else {
-            pos = xorshift32(reuse_seed | rand()) % unused_len;
-            gsol[i][0] = gsol[unused[pos]][0];
-            gsol[i][1] = gsol[unused[pos]][1];
-            gsol[i][2] = gsol[unused[pos]][2];
-            reuse_seed = xorshift32(reuse_seed | rand());
+        if (random_below(&stream, 101) > goal) {
+            pos = random_below(&stream, unused_len);
+            gsol[i*3]   = gsol[unused[pos]*3];
+            gsol[i*3+1] = gsol[unused[pos]*3+1];
+            gsol[i*3+2] = gsol[unused[pos]*3+2];
         }
         int tmp = unused[pos];
         unused[pos] = unused[--unused_len];
         unused[unused_len] = tmp;
     }
-    int * flattened = (int*) malloc(size*3*sizeof(int));
-    for (int i = 0, j = 0; j < size; j++) {
-        for (int p = 0; p < 3; i++, p++) flattened[i] = gsol[j][p];
-        free(gsol[j]);
-    }
-    free(gsol);
-    free(match);
     free(unused);
-    return flattened;
-}
\ No newline at end of file
+}
+
+// permutation genome: an individual is stored as the pixel ids (positions in the
+// original image) placed at each position instead of a copy of every rgb value.
+// orig_packed holds the original pixels packed as 0xRRGGBB so a pixel is compared
+// with a single int compare
+
+int perm_count_matches(unsigned int * perm, unsigned int * orig_packed, size_t size) {
+    int matches = 0;
+    for (size_t i = 0; i < size; i++) {
+        if (orig_packed[perm[i]] == orig_packed[i]) matches++;
+    }
+    return matches;
+}
+
+void perm_batch_count_matches(unsigned int * population, unsigned int * orig_packed, int * matches, size_t num_inds, size_t size) {
+    for (size_t k = 0; k < num_inds; k++)
+        matches[k] = perm_count_matches(population + k*size, orig_packed, size);
+}
+
+float perm_evaluate_fitness(unsigned int * perm, unsigned int * orig_packed, double goal, size_t size) {
+    size_t pixels_similar = 0;
+    for (size_t i = 0; i < size; i++) {
+        if (orig_packed[perm[i]] == orig_packed[i]) pixels_similar++;
+    }
+    float percent_similar = ((float) pixels_similar / size) * 100;
+    float fitness = fabs(percent_similar - goal);
+    return fitness;
+}
+
+// swaps num_swaps random ids of child. swaps of two pixels of the same color leave the
+// image unchanged and are redrawn (a bounded number of times), as in swap_pixels
+// matches is the number of matching pixels before the swaps and is updated by only
+// checking the swapped positions
+int perm_swap(unsigned int * child, unsigned int * orig_packed, int matches, int num_swaps, rng_stream * stream, size_t size) {
+    for (int i = 0; i < num_swaps; i++) {
+        size_t pos1 = random_below(stream, size);
+        size_t pos2 = random_below(stream, size);
+        for (int tries = 0; tries < MAX_REDRAWS && orig_packed[child[pos1]] == orig_packed[child[pos2]]; tries++)
+            pos2 = random_below(stream, size);
+
+        if (orig_packed[child[pos1]] == orig_packed[child[pos2]]) continue;
+        matches -= (orig_packed[child[pos1]] == orig_packed[pos1]) + (orig_packed[child[pos2]] == orig_packed[pos2]);
+        unsigned int tmp = child[pos1];
+        child[pos1] = child[pos2];
+        child[pos2] = tmp;
+        matches += (orig_packed[child[pos1]] == orig_packed[pos1]) + (orig_packed[child[pos2]] == orig_packed[pos2]);
+    }
+    return matches;
+}
+
+// returns the number of matching pixels of child given the matches of perm (child may be
+// perm itself to mutate in place)
+int perm_mass_swap(unsigned int * perm, unsigned int * child, unsigned int * orig_packed, int matches, uint64_t key, double swap_share, size_t size) {
+    rng_stream stream = {key, 0};
+    if (child != perm) memcpy(child, perm, size * sizeof(unsigned int));
+    return perm_swap(child, orig_packed, matches, effective_swaps(&stream, size, swap_share), &stream, size);
+}
+
+int perm_smart_swap(unsigned int * perm, unsigned int * child, unsigned int * orig_packed, int matches, uint64_t key, int max_swap, double swap_share, size_t size) {
+    rng_stream stream = {key, 0};
+    if (child != perm) memcpy(child, perm, size * sizeof(unsigned int));
+    if (max_swap < 1) max_swap = 1;
+    return perm_swap(child, orig_packed, matches, effective_swaps(&stream, max_swap, swap_share), &stream, size);
+}
+
+// color class index of the original image, built once per image by the caller:
+// class_order lists the pixel ids of every color class back to back (ids sorted by color),
+// class of every id is class_of[id] and class c holds class_order[class_start[c]] to
+// class_order[class_start[c+1] - 1]
+
+// writes into ids the pixel ids of perm in color class order: the k-th position holding a
+// color gets the k-th id of that color's class. individuals showing the same image get the
+// same ids, so a crossover does not spend its segment exchanging pixels of identical color
+void perm_class_ids(unsigned int * perm, unsigned int * ids, unsigned int * class_order, unsigned int * class_of,
+                    unsigned int * class_start, size_t num_classes, size_t size) {
+    unsigned int * next = (unsigned int*) kernel_malloc(num_classes * sizeof(unsigned int));
+    memcpy(next, class_start, num_classes * sizeof(unsigned int));
+    for (size_t i = 0; i < size; i++) ids[i] = class_order[next[class_of[perm[i]]]++];
+    free(next);
+}
+
+// picks a crossover segment [*pos1, *pos2] no longer than max_cross pixels
+// (the whole individual if it has a single pixel, so the child is a copy of parent1)
+void perm_cross_points(int * pos1, int * pos2, size_t max_cross, uint64_t key, size_t size) {
+    rng_stream stream = {key, 0};
+    if (size < 2) {
+        *pos1 = *pos2 = 0;
+        return;
+    }
+    if (max_cross < 2) max_cross = 2;
+    if (max_cross > size) max_cross = size;
+    *pos1 = random_below(&stream, size);
+    *pos2 = *pos1 + 1 + random_below(&stream, max_cross - 1);
+    if (*pos2 >= size) *pos2 = size - 1;
+    if (*pos1 == *pos2) *pos1 = *pos2 - 1;
+}
+
+// crossovers work on pixel ids (rgb individuals are converted to ids by the caller).
+// ids are unique so every lookup goes through an id -> position index instead of
+// a search and each crossover is O(size)
+
+// pmx on pixel ids. the mapping between the segment of parent1 and parent2 is
+// followed through the id -> position index of each parent
+void perm_pmx(unsigned int * parent1, unsigned int * parent2, unsigned int * child, int pos1, int pos2, size_t size) {
+    unsigned int * p1_pos = (unsigned int*) kernel_malloc(size * sizeof(unsigned int));
+    unsigned int * p2_pos = (unsigned int*) kernel_malloc(size * sizeof(unsigned int));
+    for (size_t i = 0; i < size; i++) {
+        p1_pos[parent1[i]] = i;
+        p2_pos[parent2[i]] = i;
+        child[i] = size;
+    }
+    // copy random segment from P1 to child
+    for (int i = pos1; i <= pos2; i++) child[i] = parent1[i];
+    // place ids of P2's segment that were not copied from P1
+    for (int i = pos1; i <= pos2; i++) {
+        unsigned int id = parent2[i];
+        if (pos1 <= p1_pos[id] && p1_pos[id] <= pos2) continue;
+        int child_pos = i;
+        while (pos1 <= child_pos && child_pos <= pos2)
+            child_pos = p2_pos[parent1[child_pos]];
+        child[child_pos] = id;
+    }
+    // fill the rest from P2
+    for (size_t i = 0; i < size; i++) {
+        if (child[i] == size) child[i] = parent2[i];
+    }
+    free(p1_pos);
+    free(p2_pos);
+}
+
+void perm_pmx_cross(unsigned int * parent1, unsigned int * parent2, unsigned int * child, uint64_t key, size_t size) {
+    int pos1, pos2;
+    perm_cross_points(&pos1, &pos2, size, key, size);
+    perm_pmx(parent1, parent2, child, pos1, pos2, size);
+}
+
+// pmx cross has range limit
+void perm_smart_pmx_cross(unsigned int * parent1, unsigned int * parent2, unsigned int * child, uint64_t key, size_t size, size_t max_cross) {
+    int pos1, pos2;
+    perm_cross_points(&pos1, &pos2, max_cross, key, size);
+    perm_pmx(parent1, parent2, child, pos1, pos2, size);
+}
+
+void perm_order_cross(unsigned int * parent1, unsigned int * parent2, unsigned int * child, uint64_t key, size_t size) {
+    int pos1, pos2;
+    perm_cross_points(&pos1, &pos2, size, key, size);
+    bool * in_segment = (bool*) kernel_calloc(size, sizeof(bool));
+
+    // copy random segment from P1 to child
+    for (int i = pos1; i <= pos2; i++) {
+        child[i] = parent1[i];
+        in_segment[parent1[i]] = true;
+    }
+    // copy rest from second parent in order, starting after the segment
+    size_t child_iter = (pos2 + 1) % size;
+    for (size_t k = 0, p2_iter = (pos2 + 1) % size; k < size; k++, p2_iter = (p2_iter + 1) % size) {
+        if (in_segment[parent2[p2_iter]]) continue;
+        child[child_iter] = parent2[p2_iter];
+        child_iter = (child_iter + 1) % size;
+    }
+    free(in_segment);
+}
@@ -0,0 +1,221 @@
+# Batch runner for Generating Accurately Censored Images
+# runs every image x goal x algorithm job of a manifest across a pool of workers
+#
+# usage: python "python code/BatchGACI.py" batch_manifest.json [--workers N] [--summary file.csv]
+#                                                             [--cache folder | --no-cache]
+#
+# the manifest is a JSON file such as:
+# {
+#     "images": ["./images/Face.png"],
+#     "goals": [25, 50, 75],
+#     "algorithms": ["EPGACI", "GAGACI", "GSGACI"],
+#     "runs": 5,
+#     "population_size": 15,
+#     "iterations": {"EPGACI": 200, "GAGACI": 10},
+#     "permutation": true,
+#     "exact": true,
+#     "tolerance": 0.01,
+#     "patience": 50,
+#     "seed": 0,
+#     "compact": false,
+#     "checkpoint_every": 10
+# }
+# iterations may also be a single number used by every evolutionary algorithm
+# evolutionary runs stop early once their fitness is within tolerance or has not improved
+# in patience generations (iterations is then an upper bound)
+# exact (the default, as in GSGACI.py) makes GSGACI jobs hit the goal exactly, false runs the
+# per-pixel greedy_generate
+# compact saves every result as a compact .gaci file (pixel ids and metadata) instead of a PNG
+# every result is saved as '<goal> +- <fitness>% run <run>' in its goal's folder, and the
+# summary records each job's file
+# checkpoint_every checkpoints evolutionary jobs every that many generations, so the jobs of a
+# killed batch resume from their latest checkpoint when the batch is run again (null for none)
+#
+# every result is also stored in a content addressed cache keyed by the image's pixels, the
+# algorithm, goal, parameters and seed. a job already in the cache is not run again: its
+# result is rebuilt from the cache (only if its file is missing from the results folder)
+
+from Container import (Checkpoint, EP_Generation, GA_Generation, Greedy_Solution, Result_Cache, image_hash, result_file_name,
+                       results_folder, seed_all)
+from multiprocessing import shared_memory
+from PIL import Image
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing as mp
+import numpy as np
+import os
+import time
+
+generations = {"EPGACI": EP_Generation, "GAGACI": GA_Generation}
+algorithms  = ["EPGACI", "GAGACI", "GSGACI"]
+
+# decoded images of the pool, shared by every job of a worker: img_file -> PIL image
+shared_images = {}
+# shared memory blocks backing shared_images, kept open while the worker lives
+shared_blocks = []
+
+# attaches a worker to the images decoded once by the main process
+def attach_images(image_specs):
+    for img_file, shm_name, shape in image_specs:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shared_blocks.append(shm)
+        shared_images[img_file] = Image.fromarray(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+
+# settings of a job that change its result, part of its cache key
+def job_params(algorithm, population_size, iterations, permutation, exact, tolerance, patience):
+    if algorithm == "GSGACI":
+        return {"exact": exact}
+    return {"population_size": population_size, "iterations": iterations, "permutation": permutation,
+            "tolerance": tolerance, "patience": patience}
+
+# writes a cached result to the results folder as the job would have saved it, unless it is
+# already there. returns the result's file
+def save_cached(stored, img_file, algorithm, goal, run, image, compact):
+    path = f"{results_folder}/{os.path.basename(img_file).replace('.png', ' results')}/{algorithm}/{goal}%"
+    file = f"{path}/{result_file_name(goal, stored.meta['fit'], compact, run)}"
+    if not os.path.exists(file):
+        os.makedirs(path, exist_ok=True)
+        if compact: stored.save(file)
+        else: stored.save_png(file, np.asarray(image).reshape((-1, 3)))
+    return file
+
+# runs one job (or takes it from the cache) and saves its result through create_folder_and_save
+# returns the job's summary row
+def run_job(job):
+    (img_file, algorithm, goal, run, population_size, iterations, permutation, exact, tolerance, patience, seed, stream,
+     source_hash, compact, cache_folder, checkpoint_every) = job
+    image = shared_images[img_file]
+    start_time = time.perf_counter()
+    cache = None if cache_folder is None else Result_Cache(cache_folder)
+    params = job_params(algorithm, population_size, iterations, permutation, exact, tolerance, patience)
+    key = Result_Cache.key(source_hash, algorithm, goal, params, seed, stream)
+    stored = None if cache is None else cache.get(key)
+    if stored is not None:
+        file = save_cached(stored, img_file, algorithm, goal, run, image, compact)
+        return {"image": os.path.basename(img_file), "algorithm": algorithm, "goal": goal, "run": run,
+                "seconds": round(time.perf_counter() - start_time, 3), "generations": stored.meta["generations"],
+                "fitness": round(stored.meta["fit"], 4), "cached": True, "path": os.path.dirname(file), "file": file}
+
+    seed_all(seed, stream)
+    if algorithm == "GSGACI":
+        result = Greedy_Solution(img_file, goal, image=image)
+        result.exact_generate() if exact else result.greedy_generate()
+        result.evaluate_fitness()
+        fitness = result.fit
+        generations_run = 0
+    else:
+        result = generations[algorithm](img_file, population_size, goal, permutation, image=image,
+                                        tolerance=tolerance, patience=patience)
+        result.generate_population()
+        result.evaluate_population()
+        # checkpoints are named by the job's cache key, which identifies the job
+        checkpoint = None if not checkpoint_every else Checkpoint(f"{results_folder}/checkpoints/{key}", checkpoint_every)
+        generations_run = result.run(iterations, checkpoint)
+        fitness = result.best_fit
+    seconds = time.perf_counter() - start_time
+    # the run number keeps the runs of a job (often of equal fitness) from overwriting each other
+    file = result.create_folder_and_save(algorithm, compact, run)
+    if algorithm != "GSGACI" and checkpoint is not None: checkpoint.remove()
+    if cache is not None:
+        stored = result.compact_result()
+        stored.meta.update(algorithm=algorithm, params=params, seed=seed, stream=stream, image=source_hash,
+                           generations=generations_run, seconds=round(seconds, 3))
+        cache.put(key, stored)
+    return {"image": os.path.basename(img_file), "algorithm": algorithm, "goal": goal, "run": run,
+            "seconds": round(seconds, 3), "generations": generations_run, "fitness": round(float(fitness), 4),
+            "cached": False, "path": result.path, "file": file}
+
+# random stream of a job, derived from what the job is rather than where it is in the
+# manifest, so editing the manifest does not change (or uncache) the other jobs
+def job_stream(source_hash, algorithm, goal, run):
+    return int(hashlib.sha256(f"{source_hash}:{algorithm}:{goal}:{run}".encode()).hexdigest()[:15], 16)
+
+# expands a manifest into its list of jobs
+# image_hashes maps every image of the manifest to its image_hash, cache_folder is None
+# to run every job without the cache
+def manifest_jobs(manifest, image_hashes, cache_folder=None):
+    iterations = manifest.get("iterations", 200)
+    seed = manifest.get("seed", int(np.random.SeedSequence().entropy % 2**63))
+    jobs = []
+    for img_file in manifest["images"]:
+        for algorithm in manifest.get("algorithms", algorithms):
+            if algorithm not in algorithms:
+                raise ValueError(f"unknown algorithm {algorithm}, expected one of {algorithms}")
+            for goal in manifest.get("goals", [25, 50, 75]):
+                for run in range(manifest.get("runs", 1)):
+                    jobs.append((img_file, algorithm, goal, run + 1, manifest.get("population_size", 15),
+                                 iterations.get(algorithm, 200) if isinstance(iterations, dict) else iterations,
+                                 manifest.get("permutation", True), manifest.get("exact", True),
+                                 manifest.get("tolerance", 0), manifest.get("patience"), seed,
+                                 job_stream(image_hashes[img_file], algorithm, goal, run + 1), image_hashes[img_file],
+                                 manifest.get("compact", False), cache_folder, manifest.get("checkpoint_every")))
+    return jobs
+
+# prints the summary rows as an aligned table
+def print_summary(rows):
+    columns = ["image", "algorithm", "goal", "run", "seconds", "generations", "fitness", "cached"]
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run image x goal x algorithm censoring jobs across a worker pool")
+    parser.add_argument("manifest", help="JSON manifest of images, goals and algorithms")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--summary", default=f"{results_folder}/batch summary.csv", help="CSV file for the per-job summary")
+    parser.add_argument("--cache", default=f"{results_folder}/cache", help="folder of the result cache")
+    parser.add_argument("--no-cache", action="store_true", help="run every job, without reading or filling the cache")
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    print("\nBatchGACI started...")
+    print("-------------")
+
+    # decode every source image once into shared memory for all workers
+    blocks = []
+    image_specs = []
+    image_hashes = {}
+    try:
+        for img_file in manifest["images"]:
+            image = Image.open(img_file).convert('RGB')
+            image_hashes[img_file] = image_hash(image)
+            pixels = np.asarray(image)
+            shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+            blocks.append(shm)
+            np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+            image_specs.append((img_file, shm.name, pixels.shape))
+        jobs = manifest_jobs(manifest, image_hashes, None if args.no_cache else args.cache)
+        print(f"{len(jobs)} jobs on {args.workers} workers")
+
+        start_time = time.perf_counter()
+        rows = []
+        with mp.Pool(args.workers, initializer=attach_images, initargs=(image_specs,)) as pool:
+            for row in pool.imap_unordered(run_job, jobs):
+                rows.append(row)
+                print(f"[{len(rows)}/{len(jobs)}] {row['image']} {row['algorithm']} {row['goal']}% "
+                      f"run {row['run']}: fitness {row['fitness']} in {row['seconds']} seconds{' (cached)' if row['cached'] else ''}")
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    rows.sort(key=lambda row: (row["image"], row["algorithm"], row["goal"], row["run"]))
+    print("-----------------")
+    if rows: print_summary(rows)
+    os.makedirs(os.path.dirname(args.summary) or ".", exist_ok=True)
+    with open(args.summary, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["image", "algorithm", "goal", "run", "seconds", "generations", "fitness", "cached", "path", "file"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print("------------------")
+    print(f"Batch complete in {time.perf_counter()-start_time:.3f} seconds")
+    print(f"Summary stored in {args.summary}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Benchmark suite for Generating Accurately Censored Images
+# times the ctypes kernels and the python stages of the generation loop on synthetic images
+# of increasing size and on the fixture images, and compares two result files
+#
+# usage (from the repository root):
+#   python "python code/BenchGACI.py" run [--sizes 64 256 1024 2048] [--populations 15] [--fixtures]
+#                                         [--rgb] [--backends c numpy] [--output bench.json]
+#   python "python code/BenchGACI.py" compare old.json new.json [--threshold 0.1]
+#
+# every case runs in its own process so peak RSS is measured per case. results are written
+# to JSON with the time per op (median of the repeats), pixels per second and peak RSS
+# with several backends every case runs on each of them and the run ends with the time per
+# op of every backend relative to the first one
+# compare flags every benchmark whose time per op grew by more than threshold and exits
+# with status 1 if there is any regression
+
+from Container import EP_Generation, backends, kernels, next_stream, seed_all, set_backend
+from ctypes import c_float, c_uint
+from PIL import Image
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing as mp
+import numpy as np
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak RSS is reported as None
+    resource = None
+
+# peak resident memory of this process in MB
+def peak_rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+# runs op until it took min_time seconds in total (at least min_repeats times)
+# setup runs untimed before every repeat. returns the median time of one op and the repeats
+def time_op(op, setup=None, min_time=.2, min_repeats=3, max_repeats=1000):
+    times = []
+    while (sum(times) < min_time or len(times) < min_repeats) and len(times) < max_repeats:
+        if setup is not None: setup()
+        start_time = time.perf_counter()
+        op()
+        times.append(time.perf_counter() - start_time)
+    return float(np.median(times)), len(times)
+
+# synthetic size x size image with a limited palette so that, as in real images, many
+# pixels share a color
+def synthetic_image(size, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels // 32 * 32)
+
+# times every kernel and stage on one image. returns one result row per benchmark
+def run_case(case, image, population_size, permutation, backend, min_time):
+    set_backend(backend)
+    seed_all(0)
+    parent = EP_Generation(case, population_size, 50, permutation, image=image)
+    n = parent.num_pixels
+    rows = []
+    def record(benchmark, seconds, repeats, pixels=n):
+        rows.append({"case": case, "pixels": n, "population": population_size, "mode": "perm" if permutation else "rgb",
+                     "backend": backend, "benchmark": benchmark, "seconds_per_op": seconds,
+                     "pixels_per_second": pixels / seconds if seconds else None, "repeats": repeats})
+
+    parent.generate_population()
+    parent.evaluate_population()
+
+    # kernels, in the genome of the run
+    ind = parent.population[0]
+    child = np.empty_like(ind)
+    orig = parent.orig
+    matches = parent.matches[0]
+    record("evaluate_fitness", *time_op(lambda: kernels().count_matches(ind, orig), min_time=min_time))
+    share = parent.swap_share
+    record("mass_swap", *time_op(lambda: kernels().mass_swap(ind, child, orig, matches, next_stream(), share), min_time=min_time))
+    record("smart_swap", *time_op(lambda: kernels().smart_swap(ind, child, orig, matches, next_stream(), n // 10, share), min_time=min_time))
+
+    # crossovers always run on pixel ids
+    perm = parent.individual_ids(parent.population[0])
+    perm_2 = parent.individual_ids(parent.population[1])
+    cross_child = np.empty(n, dtype=c_uint)
+    record("pmx_cross", *time_op(lambda: kernels().pmx_cross(perm, perm_2, cross_child, next_stream()), min_time=min_time))
+    record("order_cross", *time_op(lambda: kernels().order_cross(perm, perm_2, cross_child, next_stream()), min_time=min_time))
+
+    fitness = np.asarray(parent.fitness[:population_size], dtype=c_float)
+    seconds, repeats = time_op(lambda: kernels().tournament_select(fitness, 3, next_stream()), min_time=min_time)
+    record("tournament_select", seconds, repeats, pixels=population_size)
+
+    solution = np.empty_like(parent.orig_pixels)
+    record("greedy_generate", *time_op(lambda: kernels().greedy_generate(parent.orig_pixels, solution, 50, next_stream()), min_time=min_time))
+
+    # python stages of the generation loop, each timed on the state left by the previous one
+    stages = {"generate_children": [], "evaluate_population": [], "round_robin": [], "sort_wins": [], "survivor_select": []}
+    def stage(name, op):
+        start_time = time.perf_counter()
+        op()
+        stages[name].append(time.perf_counter() - start_time)
+    iteration = 0
+    while sum(map(sum, stages.values())) < min_time * len(stages) or iteration < 3:
+        stage("generate_children", lambda: parent.generate_children(iteration, 1000))
+        stage("round_robin", lambda: parent.round_robin(7, 80))
+        stage("sort_wins", parent.sort_wins)
+        stage("survivor_select", parent.survivor_select)
+        stage("evaluate_population", parent.evaluate_population)
+        iteration += 1
+    for name, times in stages.items():
+        record(name, float(np.median(times)), len(times), pixels=n * population_size)
+
+    peak = peak_rss_mb()
+    for row in rows: row["peak_rss_mb"] = peak
+    return rows
+
+# cases of a run: (case name, image file or synthetic size, population size)
+def benchmark_cases(args):
+    cases = [(f"synthetic {size}x{size}", size, population) for size in args.sizes for population in args.populations]
+    if args.fixtures:
+        cases += [(os.path.basename(img_file), img_file, population)
+                  for img_file in sorted(glob.glob("./images/*.png")) for population in args.populations]
+    return cases
+
+# runs one case (called in a fresh worker process)
+def run_benchmark(case, source, population_size, permutation, backend, min_time):
+    image = synthetic_image(source) if isinstance(source, int) else Image.open(source).convert('RGB')
+    return run_case(case, image, population_size, permutation, backend, min_time)
+
+# time per op of every backend relative to the first backend, per case and benchmark
+def print_backend_ratios(results, names):
+    times = {(row["case"], row["population"], row["benchmark"], row["backend"]): row["seconds_per_op"] for row in results}
+    print(f"{'case':<24} {'pop':>4} {'benchmark':<20}" + "".join(f" {name + ' ms':>12}" for name in names) +
+          "".join(f" {name + '/' + names[0]:>14}" for name in names[1:]))
+    for case, population, benchmark in dict.fromkeys((row["case"], row["population"], row["benchmark"]) for row in results):
+        row_times = [times.get((case, population, benchmark, name)) for name in names]
+        print(f"{case:<24} {population:>4} {benchmark:<20}" +
+              "".join(f" {seconds*1e3:12.3f}" if seconds else f" {'-':>12}" for seconds in row_times) +
+              "".join(f" {seconds / row_times[0]:14.2f}" if seconds and row_times[0] else f" {'-':>14}" for seconds in row_times[1:]))
+
+def run(args):
+    results = []
+    for case, source, population in benchmark_cases(args):
+        for backend in args.backends:
+            print(f"{case}, population {population}, {backend} backend...", flush=True)
+            # a fresh process per case so that peak RSS belongs to that case alone
+            with mp.Pool(1, maxtasksperchild=1) as pool:
+                rows = pool.apply(run_benchmark, (case, source, population, not args.rgb, backend, args.min_time))
+            for row in rows:
+                print(f"    {row['benchmark']:<20} {row['seconds_per_op']*1e3:10.3f} ms/op"
+                      f"{row['pixels_per_second'] or 0:16,.0f} pixels/s")
+            print(f"    peak RSS {rows[0]['peak_rss_mb']} MB")
+            results += rows
+    if len(args.backends) > 1:
+        print("-----------------")
+        print_backend_ratios(results, args.backends)
+    output = {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                       "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()},
+              "results": results}
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=1)
+    print(f"Results stored in {args.output}")
+
+# compares the time per op of every benchmark found in both result files
+def compare(args):
+    # results from before backends were recorded ran on the C kernels
+    def key(row):
+        return row["case"], row["population"], row["mode"], row.get("backend", "c"), row["benchmark"]
+    with open(args.old) as file:
+        old = {key(row): row for row in json.load(file)["results"]}
+    with open(args.new) as file:
+        new = {key(row): row for row in json.load(file)["results"]}
+    regressions = 0
+    print(f"{'case':<24} {'pop':>4} {'mode':<5} {'backend':<7} {'benchmark':<20} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]["seconds_per_op"] / old[key]["seconds_per_op"]
+        regressed = ratio > 1 + args.threshold
+        regressions += regressed
+        print(f"{key[0]:<24} {key[1]:>4} {key[2]:<5} {key[3]:<7} {key[4]:<20} {old[key]['seconds_per_op']*1e3:10.3f} "
+              f"{new[key]['seconds_per_op']*1e3:10.3f} {ratio:7.2f}{'  REGRESSION' if regressed else ''}")
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{' '.join(map(str, key))} only in {args.old if key in old else args.new}")
+    print(f"{regressions} regression{'' if regressions == 1 else 's'} over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pixel kernels and the generation loop")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and store the results as JSON")
+    run_parser.add_argument("--sizes", type=int, nargs="*", default=[64, 256, 1024, 2048], help="widths of the square synthetic images")
+    run_parser.add_argument("--populations", type=int, nargs="+", default=[15], help="population sizes")
+    run_parser.add_argument("--fixtures", action="store_true", help="also benchmark the images in ./images")
+    run_parser.add_argument("--rgb", action="store_true", help="store individuals as rgb values instead of permutations")
+    run_parser.add_argument("--backends", nargs="+", choices=list(backends), default=["c"], help="kernel backends to benchmark")
+    run_parser.add_argument("--min-time", type=float, default=.2, help="minimum seconds spent timing each benchmark")
+    run_parser.add_argument("--output", default="./alg results/bench.json", help="JSON file for the results")
+    compare_parser = commands.add_parser("compare", help="flag regressions between two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=.1, help="slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == "run" else compare(args))
+
+if __name__ == '__main__':
+    main()
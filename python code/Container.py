@@ -1,138 +1,1079 @@
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import *
+from multiprocessing import shared_memory
 from PIL import Image
+import copy
+import cProfile
+import hashlib
+import json
+import multiprocessing as mp
 import numpy as np
 import os
-import random as rd
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
 
 results_folder = './alg results'
 if not os.path.exists(results_folder): 
     os.mkdir(results_folder)
 
-lib = CDLL(os.path.join("./c code", "clibrary.so"))
-
 c_int_p = POINTER(c_uint)
 c_float_p = POINTER(c_float)
 
-lib.evaluate_fitness.restype = c_float
-lib.mass_swap.restype = c_int_p
-lib.smart_swap.restype = c_int_p
-lib.greedy_generate.restype = c_int_p
+# the pixel kernels run on one of two interchangeable backends with the same methods:
+# 'c' calls the loops of c code/clibrary.so through ctypes, 'numpy' does whole-array work
+# in numpy and needs no compiled library. the backend is picked with set_backend or the
+# GACI_BACKEND environment variable ('c' by default) and is only created, and the C library
+# only loaded, the first time a kernel is needed
+# individuals are numpy arrays: permutation individuals are 1D pixel ids compared through
+# the packed original, rgb individuals are (num_pixels, 3) compared with the original's pixels
+clibrary_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "c code", "clibrary.so")
+
+# every kernel the C backend calls. a library built from an older pixel_read.c lacks some
+# of them, which is caught when it is loaded instead of at the first call
+kernel_symbols = ["count_matches", "batch_count_matches", "evaluate_fitness", "mass_swap", "smart_swap", "greedy_generate",
+                  "tournament_select", "print_individual", "kernel_allocated_bytes", "perm_count_matches",
+                  "perm_batch_count_matches", "perm_evaluate_fitness", "perm_mass_swap", "perm_smart_swap", "perm_class_ids",
+                  "perm_pmx_cross", "perm_smart_pmx_cross", "perm_order_cross"]
+
+# loads clibrary.so (relative to this file, so scripts may run from any folder) and declares
+# the signatures of its kernels. raises AttributeError if a kernel is missing
+def load_clibrary():
+    lib = CDLL(clibrary_file)
+    for symbol in kernel_symbols: getattr(lib, symbol)
+    lib.evaluate_fitness.restype = c_float
+    lib.perm_evaluate_fitness.restype = c_float
+    lib.kernel_allocated_bytes.restype = c_size_t
+    # kernels taking a random stream key (uint64) and size_t sizes
+    lib.mass_swap.argtypes = [c_int_p, c_int_p, c_int_p, c_int, c_uint64, c_double, c_size_t]
+    lib.smart_swap.argtypes = [c_int_p, c_int_p, c_int_p, c_int, c_uint64, c_int, c_double, c_size_t]
+    lib.perm_mass_swap.argtypes = lib.mass_swap.argtypes
+    lib.perm_smart_swap.argtypes = lib.smart_swap.argtypes
+    lib.tournament_select.argtypes = [c_float_p, c_int, c_uint64, c_size_t]
+    lib.greedy_generate.argtypes = [c_int_p, c_int_p, c_double, c_uint64, c_size_t]
+    lib.perm_pmx_cross.argtypes = [c_int_p, c_int_p, c_int_p, c_uint64, c_size_t]
+    lib.perm_order_cross.argtypes = lib.perm_pmx_cross.argtypes
+    lib.perm_smart_pmx_cross.argtypes = lib.perm_pmx_cross.argtypes + [c_size_t]
+    return lib
+
+# pointer to the data of a uint32 array
+def uint_p(array):
+    return array.ctypes.data_as(c_int_p)
+
+class C_Kernels():
+    name = 'c'
+
+    def __init__(self):
+        try:
+            self.lib = load_clibrary()
+        # AttributeError: a missing kernel, the library was built from an older pixel_read.c
+        except (OSError, AttributeError) as error:
+            raise OSError(f"could not load {clibrary_file} ({error}), build it from c code/pixel_read.c "
+                          f"(gcc -O2 -shared -fPIC -o \"c code/clibrary.so\" \"c code/pixel_read.c\" -lm) "
+                          f"or select the numpy backend (set_backend('numpy') or GACI_BACKEND=numpy)") from error
+
+    # bytes allocated by the kernels since the library was loaded
+    def allocated_bytes(self):
+        return self.lib.kernel_allocated_bytes()
+
+    # number of pixels of an individual matching the original
+    def count_matches(self, ind, orig):
+        count = self.lib.perm_count_matches if ind.ndim == 1 else self.lib.count_matches
+        return count(uint_p(ind), uint_p(orig), len(ind))
+
+    # writes the number of matching pixels of every individual of a contiguous population into matches
+    def batch_count_matches(self, population, orig, matches):
+        count_batch = self.lib.perm_batch_count_matches if population.ndim == 2 else self.lib.batch_count_matches
+        count_batch(uint_p(population), uint_p(orig), matches.ctypes.data_as(POINTER(c_int)), len(population), population.shape[1])
+
+    # writes a copy of parent with a random number of swaps (below the number of pixels) into
+    # child. returns the matching pixels of child given the matches of parent
+    def mass_swap(self, parent, child, orig, matches, key, swap_share):
+        mass_swap = self.lib.perm_mass_swap if parent.ndim == 1 else self.lib.mass_swap
+        return mass_swap(uint_p(parent), uint_p(child), uint_p(orig), matches, key, swap_share, len(parent))
+
+    # as mass_swap with a random number of swaps below max_swap
+    def smart_swap(self, parent, child, orig, matches, key, max_swap, swap_share):
+        smart_swap = self.lib.perm_smart_swap if parent.ndim == 1 else self.lib.smart_swap
+        return smart_swap(uint_p(parent), uint_p(child), uint_p(orig), matches, key, max_swap, swap_share, len(parent))
+
+    # writes the pixel ids of perm in color class order into ids (see Generation.class_ids)
+    def class_ids(self, perm, ids, class_order, class_of, class_start):
+        self.lib.perm_class_ids(uint_p(perm), uint_p(ids), uint_p(class_order), uint_p(class_of), uint_p(class_start),
+                                c_size_t(len(class_start) - 1), c_size_t(len(perm)))
+
+    # PMX crossover of two id arrays into child, on a segment of at most max_cross pixels
+    def pmx_cross(self, ids_1, ids_2, child, key, max_cross=None):
+        if max_cross is None:
+            self.lib.perm_pmx_cross(uint_p(ids_1), uint_p(ids_2), uint_p(child), key, len(child))
+        else:
+            self.lib.perm_smart_pmx_cross(uint_p(ids_1), uint_p(ids_2), uint_p(child), key, len(child), max_cross)
+
+    def order_cross(self, ids_1, ids_2, child, key):
+        self.lib.perm_order_cross(uint_p(ids_1), uint_p(ids_2), uint_p(child), key, len(child))
+
+    # position of the winner of a tournament of k individuals over the float32 fitnesses
+    def tournament_select(self, fitness, k, key):
+        return self.lib.tournament_select(fitness.ctypes.data_as(c_float_p), k, key, len(fitness))
+
+    # writes a greedy solution of the rgb orig_pixels into solution
+    def greedy_generate(self, orig_pixels, solution, goal, key):
+        self.lib.greedy_generate(uint_p(orig_pixels), uint_p(solution), c_double(goal), key, len(orig_pixels))
+
+    # fitness of rgb pixels against the original
+    def evaluate_fitness(self, pixels, orig_pixels, goal):
+        return self.lib.evaluate_fitness(uint_p(np.ascontiguousarray(pixels, dtype=c_uint)), uint_p(orig_pixels), c_double(goal), len(pixels))
+
+    def print_individual(self, pixels):
+        self.lib.print_individual(uint_p(np.ascontiguousarray(pixels, dtype=c_uint)), len(pixels))
+
+# numpy generator of the random stream key, the counterpart of a C kernel's rng_stream
+def stream_generator(key):
+    return np.random.Generator(np.random.Philox(key=key))
+
+# crossover segment [pos1, pos2] no longer than max_cross pixels, as perm_cross_points
+# (the whole individual if it has a single pixel)
+def cross_points(generator, max_cross, size):
+    if size < 2: return 0, 0
+    max_cross = min(max(max_cross, 2), size)
+    pos1 = int(generator.integers(size))
+    pos2 = min(pos1 + 1 + int(generator.integers(max_cross - 1)), size - 1)
+    return (pos2 - 1 if pos1 == pos2 else pos1), pos2
+
+# the kernels as whole-array numpy operations. they draw from the same stream keys as the C
+# kernels but from numpy generators, so a seed reproduces its run on either backend but the
+# two backends give different runs. every kernel but greedy_generate draws from the same
+# distribution as its C counterpart
+class NumPy_Kernels():
+    name = 'numpy'
+
+    # numpy buffers are not counted
+    def allocated_bytes(self):
+        return 0
+
+    # number of pixels at positions pos holding their original color
+    def matching(self, pixels, orig, pos):
+        if pixels.ndim == 1:
+            return int(np.count_nonzero(orig[pixels] == orig[pos]))
+        return int(np.count_nonzero(np.all(pixels == orig[pos], axis=-1)))
+
+    def count_matches(self, ind, orig):
+        return self.matching(ind, orig, slice(None))
+
+    def batch_count_matches(self, population, orig, matches):
+        if population.ndim == 2:
+            matches[:] = np.count_nonzero(orig[population] == orig, axis=-1)
+        else:
+            matches[:] = np.count_nonzero(np.all(population == orig, axis=-1), axis=-1)
+
+    # all swaps of a mutation applied as one fancy-indexed permutation: the positions the
+    # swaps would touch are drawn at once (distinct) and every one of them takes the pixel of
+    # the next one. num_swaps sequential swaps touch n * (1 - e^(-2 num_swaps / n)) positions
+    # and, as in the C kernels, num_swaps only counts swaps between different colors
+    def swap(self, parent, child, orig, matches, key, bound, swap_share):
+        generator = stream_generator(key)
+        num_swaps = int(generator.integers(max(bound, 1)) * swap_share + .5)
+        np.copyto(child, parent)
+        if num_swaps == 0: return matches
+        size = len(parent)
+        moved = min(size, max(2, round(-size * np.expm1(-2 * num_swaps / (swap_share * size)))))
+        pos = generator.choice(size, moved, replace=False)
+        matches -= self.matching(parent[pos], orig, pos)
+        child[pos] = parent[np.roll(pos, 1)]
+        return matches + self.matching(child[pos], orig, pos)
+
+    def mass_swap(self, parent, child, orig, matches, key, swap_share):
+        return self.swap(parent, child, orig, matches, key, len(parent), swap_share)
+
+    def smart_swap(self, parent, child, orig, matches, key, max_swap, swap_share):
+        return self.swap(parent, child, orig, matches, key, max_swap, swap_share)
+
+    # a stable sort by class puts the k-th position of every class at its k-th id
+    def class_ids(self, perm, ids, class_order, class_of, class_start):
+        ids[np.argsort(class_of[perm], kind='stable')] = class_order
+
+    # the child takes P2 outside the segment, where ids copied from P1's segment are
+    # followed through the segment's mapping (P1 -> P2) until they leave it, all at once
+    def pmx_cross(self, ids_1, ids_2, child, key, max_cross=None):
+        size = len(child)
+        pos1, pos2 = cross_points(stream_generator(key), size if max_cross is None else max_cross, size)
+        segment = ids_1[pos1:pos2 + 1]
+        in_segment = np.zeros(size, dtype=bool)
+        in_segment[segment] = True
+        segment_pos = np.empty(size, dtype=np.intp)
+        segment_pos[segment] = np.arange(pos1, pos2 + 1)
+        np.copyto(child, ids_2)
+        child[pos1:pos2 + 1] = segment
+        conflicts = np.flatnonzero(in_segment[ids_2])
+        conflicts = conflicts[(conflicts < pos1) | (conflicts > pos2)]
+        ids = ids_2[conflicts]
+        pending = np.arange(len(ids))
+        while len(pending):
+            ids[pending] = ids_2[segment_pos[ids[pending]]]
+            pending = pending[in_segment[ids[pending]]]
+        child[conflicts] = ids
+
+    # P2's ids outside P1's segment are placed in order after the segment, wrapping around
+    def order_cross(self, ids_1, ids_2, child, key):
+        size = len(child)
+        pos1, pos2 = cross_points(stream_generator(key), size, size)
+        in_segment = np.zeros(size, dtype=bool)
+        in_segment[ids_1[pos1:pos2 + 1]] = True
+        child[pos1:pos2 + 1] = ids_1[pos1:pos2 + 1]
+        rest = np.roll(ids_2, -(pos2 + 1))
+        rest = rest[~in_segment[rest]]
+        child[(pos2 + 1 + np.arange(len(rest))) % size] = rest
+
+    def tournament_select(self, fitness, k, key):
+        generator = stream_generator(key)
+        winner = int(generator.integers(len(fitness)))
+        for opp, draw in zip(generator.integers(len(fitness), size=k - 1), generator.random(k - 1)):
+            if fitness[winner] < fitness[opp]: winner = winner if draw < 9 / 11 else int(opp)
+            elif fitness[winner] == fitness[opp]: winner = winner if draw < .5 else int(opp)
+            else: winner = winner if draw < 3 / 11 else int(opp)
+        return winner
+
+    # every position keeps its pixel with chance goal %, the others are shuffled among themselves
+    # unlike the C kernel, which copies each moved pixel from a position that may already have
+    # been overwritten and so repeats some pixels and drops others, the result is a
+    # rearrangement of the original's pixels (the C loop is sequential and is not vectorized)
+    def greedy_generate(self, orig_pixels, solution, goal, key):
+        generator = stream_generator(key)
+        moved = np.flatnonzero(generator.integers(101, size=len(orig_pixels)) > goal)
+        np.copyto(solution, orig_pixels)
+        solution[moved] = orig_pixels[generator.permutation(moved)]
+
+    def evaluate_fitness(self, pixels, orig_pixels, goal):
+        return np.float32(abs(self.count_matches(pixels, orig_pixels) / len(pixels) * 100 - goal))
+
+    def print_individual(self, pixels):
+        for pixel in pixels: print(f"[{' '.join(map(str, pixel))} ],")
+
+backends = {'c': C_Kernels, 'numpy': NumPy_Kernels}
+backend_name = os.environ.get('GACI_BACKEND', 'c')
+loaded_backend = None
+
+# selects the kernel backend ('c' or 'numpy'). worker processes inherit it through GACI_BACKEND
+def set_backend(name):
+    global backend_name, loaded_backend
+    if name not in backends: raise ValueError(f"unknown backend {name}, expected one of {list(backends)}")
+    backend_name = os.environ['GACI_BACKEND'] = name
+    loaded_backend = None
+
+# the selected backend, created on first use
+def kernels():
+    global loaded_backend
+    if loaded_backend is None: loaded_backend = backends[backend_name]()
+    return loaded_backend
+
+# sound to alert user when a run is finished (a terminal bell outside of windows)
+def alert_finished():
+    if sys.platform == 'win32':
+        import winsound
+        winsound.Beep(700, 1000)
+    else:
+        print('\a', end='', flush=True)
+
+# opens a results folder in the platform's file browser
+def open_folder(path):
+    path = os.path.realpath(path)
+    if sys.platform == 'win32':
+        os.startfile(path)
+    else:
+        try:
+            subprocess.Popen(['open' if sys.platform == 'darwin' else 'xdg-open', path])
+        except OSError:
+            print(f"Could not open {path}")
+
+# every random number comes from one seed. each kernel call draws from its own
+# counter-based stream keyed by (seed, worker, call number) and numpy draws from a Philox
+# generator keyed by (seed, worker), so runs are reproducible and the workers of a pool
+# get independent streams with no shared state
+
+# splitmix64 finalizer and stream_key of pixel_read.c on python ints, so keys are derived
+# without loading the C library
+def mix64(z):
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return z ^ (z >> 31)
+
+# key of the independent sub-stream id of key
+def stream_key(key, id):
+    return mix64(key ^ mix64((id + 1) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF))
+
+# seeds this process as worker of seed (a fresh seed if None)
+def seed_all(seed=None, worker=0):
+    global rng, rng_key, rng_calls
+    if seed is None: seed = np.random.SeedSequence().entropy
+    rng_key = stream_key(seed % 2**64, worker)
+    rng_calls = 0
+    rng = np.random.Generator(np.random.Philox(key=rng_key))
+
+# key of the random stream of the next kernel call
+def next_stream():
+    global rng_calls
+    rng_calls += 1
+    return stream_key(rng_key, rng_calls)
+
+# state of every random stream of this process (JSON serializable), e.g. for checkpoints
+def rng_state():
+    state = rng.bit_generator.state
+    return {"key": rng_key, "calls": rng_calls,
+            "numpy": {**state, "state": {name: value.tolist() for name, value in state["state"].items()},
+                      "buffer": state["buffer"].tolist()}}
+
+# continues the random streams from an rng_state
+def set_rng_state(state):
+    global rng_key, rng_calls
+    rng_key, rng_calls = state["key"], state["calls"]
+    numpy_state = state["numpy"]
+    rng.bit_generator.state = {**numpy_state, "buffer": np.array(numpy_state["buffer"], dtype=np.uint64),
+                               "state": {name: np.array(value, dtype=np.uint64) for name, value in numpy_state["state"].items()}}
+
+seed_all()
+
+# writes an (height, width, 3) uint8 array (e.g. a np.memmap) to a PNG file a band of rows
+# at a time, so the image never has to be held in memory as a whole
+def save_png_streamed(path, pixels, rows_per_band=64):
+    height, width = pixels.shape[:2]
+    def chunk(file, kind, data):
+        file.write(len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big'))
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bit rgb, no interlacing
+        chunk(file, b'IHDR', width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes([8, 2, 0, 0, 0]))
+        compressor = zlib.compressobj()
+        for top in range(0, height, rows_per_band):
+            band = np.asarray(pixels[top:top + rows_per_band], dtype=np.uint8)
+            # every row starts with filter type 0
+            rows = np.concatenate((np.zeros((len(band), 1), dtype=np.uint8), band.reshape(len(band), width * 3)), axis=1)
+            data = compressor.compress(rows.tobytes())
+            if data: chunk(file, b'IDAT', data)
+        chunk(file, b'IDAT', compressor.flush())
+        chunk(file, b'IEND', b'')
+
+# packs (N, 3) rgb pixels into one 0xRRGGBB uint32 per pixel
+def pack_pixels(pixels):
+    pixels = np.asarray(pixels, dtype=c_uint)
+    return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+# receives every stage of a generation loop run through Generation.run_stage
+# subclass it and override the stages you need
+class Observer():
+    # called before a stage runs
+    def start_stage(self, generation, stage):
+        pass
+
+    # called after a stage runs with its record: iteration, stage, wall time in seconds, bytes
+    # allocated by the C kernels, population size, and the number of individuals already
+    # evaluated with the best/mean/spread of their fitnesses (after a mutation stage the new
+    # children are in the population but not yet evaluated)
+    def end_stage(self, generation, stage, record):
+        pass
+
+    def close(self):
+        pass
+
+# writes the record of every stage as one JSON line to path
+# with profile, each stage is also profiled with cProfile and its stats are dumped to
+# '<path without extension> <stage>.prof' on close. with trace_memory, every record gets the
+# peak python memory (tracemalloc, includes numpy buffers) allocated during the stage
+class Trace_Observer(Observer):
+    def __init__(self, path, profile=False, trace_memory=False):
+        self.path = path
+        self.file = open(path, 'w')
+        # cProfile.Profile of each stage
+        self.profiles = {} if profile else None
+        self.trace_memory = trace_memory
+        # only stop tracemalloc on close if this observer started it
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing: tracemalloc.start()
+
+    def start_stage(self, generation, stage):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+        if self.profiles is not None:
+            self.profiles.setdefault(stage, cProfile.Profile()).enable()
+
+    def end_stage(self, generation, stage, record):
+        if self.profiles is not None:
+            self.profiles[stage].disable()
+        if self.trace_memory:
+            record["python_peak_bytes"] = tracemalloc.get_traced_memory()[1] - self.traced_start
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+        if self.profiles is not None:
+            for stage, profile in self.profiles.items():
+                profile.dump_stats(f'{os.path.splitext(self.path)[0]} {stage}.prof')
+        if self.started_tracing: tracemalloc.stop()
+
+# sha256 of an image's decoded rgb pixels and size, so the same picture hashes the same
+# whatever its file name or encoding
+def image_hash(image):
+    pixels = np.ascontiguousarray(np.asarray(image.convert('RGB'), dtype=np.uint8))
+    return hashlib.sha256(f"{image.size[0]}x{image.size[1]}:".encode() + pixels.tobytes()).hexdigest()
+
+# positions (flat indices) of the pixels of a size = (width, height) image inside mask, so
+# only that region of interest is censored. None if mask is None (the whole image)
+# mask is a binary (height, width) array or image (nonzero inside), a mask image's file, or
+# a list of bounding boxes (left, top, right, bottom) with right and bottom exclusive
+def roi_positions(mask, size):
+    if mask is None: return None
+    width, height = size
+    if isinstance(mask, str): mask = Image.open(mask)
+    if isinstance(mask, Image.Image): mask = np.asarray(mask.convert('L'))
+    if isinstance(mask, list):
+        inside = np.zeros((height, width), dtype=bool)
+        for left, top, right, bottom in mask:
+            inside[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = True
+    else:
+        inside = np.asarray(mask) != 0
+        if inside.shape != (height, width):
+            raise ValueError(f"mask is {inside.shape[1]}x{inside.shape[0]} but the image is {width}x{height}")
+    roi = np.flatnonzero(inside)
+    if len(roi) < 2: raise ValueError("the region of interest must hold at least two pixels")
+    return roi
+
+# sha256 of a region of interest's positions, None for the whole image
+def roi_hash(roi):
+    return None if roi is None else hashlib.sha256(np.asarray(roi, dtype=np.int64).tobytes()).hexdigest()
+
+# rgb pixels of the whole image given the pixels of its region of interest roi, the original
+# image_pixels outside of it
+def compose_roi(image_pixels, roi, pixels):
+    if roi is None: return pixels
+    composed = image_pixels.copy()
+    composed[roi] = pixels
+    return composed
+
+# pixel ids in the whole image of ids in its region of interest (ids outside of it stay in place)
+def roi_ids(roi, ids, num_image_pixels):
+    if roi is None: return ids
+    image_ids = np.arange(num_image_pixels, dtype=c_uint)
+    image_ids[roi] = roi[ids]
+    return image_ids
+
+# name of a result file: its goal and fitness, and its run when several runs of one job share
+# a folder (runs of equal fitness would otherwise overwrite each other)
+def result_file_name(goal, fit, compact=False, run=None):
+    return f"{goal} +- {fit:.4f}%{'' if run is None else f' run {run}'}.{'gaci' if compact else 'png'}"
+
+# writes file by calling write with a binary file object on a temporary file of its own in the
+# same folder, then moves it into place: readers never see a partial file and parallel writers
+# of the same file (results of equal fitness share their name) never collide
+def write_atomically(file, write):
+    fd, temp_file = tempfile.mkstemp(prefix=".", suffix=f" {os.path.basename(file)}.tmp", dir=os.path.dirname(file) or ".")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_file, file)
+    except BaseException:
+        if os.path.exists(temp_file): os.remove(temp_file)
+        raise
+
+# a censored image stored as the pixel ids of the solution (the position in the original of
+# the pixel shown at every position, a permutation for every algorithm but greedy_generate)
+# plus its metadata, instead of a PNG. the image is only rebuilt, from the original, when it
+# is asked for
+# file layout: 'GACI' and a format version byte, the JSON metadata's length (4 bytes, big
+# endian), the JSON metadata, then the zlib compressed ids. ids are stored as their offset
+# from their own position (0 for every pixel left in place, so a goal % of them) with the
+# bytes of the int32 offsets grouped by significance, which zlib compresses far better than
+# the interleaved values
+class Compact_Result():
+    magic = b'GACI\x01'
+
+    # meta holds at least width, height, goal and fit
+    def __init__(self, meta, ids):
+        self.meta = meta
+        self.ids = np.asarray(ids, dtype=c_uint)
+
+    # rgb pixels of the result, rebuilt from the original's pixels
+    def pixels(self, orig_pixels):
+        return np.asarray(orig_pixels)[self.ids]
+
+    def image(self, orig_pixels):
+        return Image.fromarray(np.reshape(self.pixels(orig_pixels), (self.meta["height"], self.meta["width"], 3)).astype(np.uint8))
+
+    def save_png(self, path, orig_pixels):
+        image = self.image(orig_pixels)
+        write_atomically(path, lambda f: image.save(f, format='PNG'))
+
+    def to_bytes(self):
+        offsets = (self.ids.astype(np.int64) - np.arange(len(self.ids))).astype('<i4')
+        header = json.dumps(self.meta, sort_keys=True).encode()
+        return self.magic + len(header).to_bytes(4, 'big') + header + zlib.compress(offsets.view(np.uint8).reshape(-1, 4).T.tobytes(), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:len(cls.magic)] != cls.magic: raise ValueError("not a compact result")
+        start = len(cls.magic) + 4
+        end = start + int.from_bytes(data[len(cls.magic):start], 'big')
+        offsets = np.frombuffer(zlib.decompress(data[end:]), dtype=np.uint8).reshape(4, -1).T.copy().view('<i4')[:, 0]
+        return cls(json.loads(data[start:end]), offsets + np.arange(len(offsets)))
+
+    # writes through a temporary file so readers never see a partial result
+    def save(self, file):
+        data = self.to_bytes()
+        write_atomically(file, lambda f: f.write(data))
+
+    @classmethod
+    def load(cls, file):
+        with open(file, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+# rebuilds the PNG of a compact result file from its original image
+def rebuild_png(compact_file, img_file, png_file=None):
+    result = Compact_Result.load(compact_file)
+    orig_pixels = np.asarray(Image.open(img_file).convert('RGB')).reshape((-1, 3))
+    png_file = os.path.splitext(compact_file)[0] + '.png' if png_file is None else png_file
+    result.save_png(png_file, orig_pixels)
+    return png_file
+
+# results stored as compact results under folder, addressed by a hash of everything that
+# determines them: the source image's pixels, the algorithm, goal, run parameters and seed
+# a repeated request is answered from the cache instead of being run again
+class Result_Cache():
+    def __init__(self, folder=f"{results_folder}/cache"):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    # key of a run. params holds every setting that changes the result (population size,
+    # iterations, genome, tolerance, ...), seed the seed and stream the run was seeded with.
+    # the kernel backend is part of the key as backends give different runs for one seed
+    @staticmethod
+    def key(source_hash, algorithm, goal, params, seed, stream=0):
+        description = {"image": source_hash, "algorithm": algorithm, "goal": goal, "params": params,
+                       "seed": seed, "stream": stream, "backend": backend_name}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def file(self, key):
+        return f"{self.folder}/{key}.gaci"
+
+    # the stored result of key, None if it was never run (or its file is unreadable)
+    def get(self, key):
+        try:
+            return Compact_Result.load(self.file(key))
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def put(self, key, result):
+        result.save(self.file(key))
+        return self.file(key)
+
+# periodic checkpoints of an EP_Generation or GA_Generation run, so a killed run resumes
+# from its latest checkpoint instead of starting over (see Generation.run)
+# the individuals and best individual are copied into '<path>.ckpt', a memory mapped file
+# holding two regions used in turn, so the previous checkpoint stays intact while the next
+# one is written. the copy is flushed to disk on a background thread while the run goes on,
+# after which '<path>.json' (iteration, fitness, match counts, progress and the random
+# streams' state) is replaced to point at the new region. a resumed run continues exactly
+# as the uninterrupted run would have
+class Checkpoint():
+    # every is the number of generations between checkpoints
+    def __init__(self, path, every=10):
+        self.path = path
+        self.every = every
+        self.memmap = None
+        # thread flushing the latest checkpoint
+        self.writer = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # metadata of the latest complete checkpoint, None if there is none
+    def load_meta(self):
+        try:
+            with open(f"{self.path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # shape of the checkpoint file of generation: two regions of its individuals and best individual
+    @staticmethod
+    def shape(generation):
+        return (2, generation.size + 1) + generation.arena.shape[1:]
+
+    # maps the checkpoint file as an array of shape. only a new checkpoint (create) may create
+    # or resize the file, restoring from a file that does not hold shape raises ValueError
+    def open_memmap(self, shape, create=False):
+        shape = tuple(shape)
+        if self.memmap is not None and self.memmap.shape == shape: return
+        self.memmap = None
+        fits = os.path.exists(f"{self.path}.ckpt") and os.path.getsize(f"{self.path}.ckpt") == np.prod(shape) * np.dtype(c_uint).itemsize
+        if not fits and not create:
+            raise ValueError(f"checkpoint {self.path}.ckpt does not hold individuals of shape {shape}")
+        self.memmap = np.memmap(f"{self.path}.ckpt", dtype=c_uint, mode='r+' if fits else 'w+', shape=shape)
+
+    # checkpoints generation after iteration generations if iteration is a multiple of every
+    def save_every(self, generation, iteration):
+        if iteration % self.every == 0: self.save(generation, iteration)
+
+    # checkpoints generation after iteration generations
+    def save(self, generation, iteration):
+        self.wait()
+        self.open_memmap(self.shape(generation), create=True)
+        meta = self.load_meta()
+        region = 0 if meta is None else 1 - meta["region"]
+        for i in range(generation.size):
+            self.memmap[region, i] = generation.population[i]
+        self.memmap[region, generation.size] = generation.best_ind
+        meta = {"region": region, "iteration": iteration, "algorithm": type(generation).__name__,
+                "image": image_hash(generation.orig_image), "roi": roi_hash(generation.roi), "goal": generation.goal,
+                "permutation": generation.permutation, "shape": list(self.memmap.shape),
+                "backend": backend_name, "state": generation.checkpoint_state(), "rng": rng_state()}
+        self.writer = threading.Thread(target=self.write, args=(meta,))
+        self.writer.start()
+
+    # flushes the new region, then points the metadata at it
+    def write(self, meta):
+        self.memmap.flush()
+        with open(f"{self.path}.json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+
+    # waits for the latest checkpoint to be on disk
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    # restores generation (after its generate_population) from the latest checkpoint
+    # returns the number of generations already run, 0 if there is no checkpoint
+    def restore(self, generation):
+        self.wait()
+        meta = self.load_meta()
+        if meta is None: return 0
+        expected = {"algorithm": type(generation).__name__, "image": image_hash(generation.orig_image), "roi": roi_hash(generation.roi),
+                    "goal": generation.goal, "permutation": generation.permutation}
+        for name, value in expected.items():
+            # checkpoints from before regions of interest always censored the whole image
+            if meta.get(name) != value:
+                raise ValueError(f"checkpoint {self.path} is of another run ({name} {meta.get(name)} instead of {value})")
+        size = meta["state"]["size"]
+        if size != generation.size:
+            raise ValueError(f"checkpoint {self.path} is of another run (population size {size} instead of {generation.size})")
+        # checkpoints from before the shape was recorded always matched the run's population
+        self.open_memmap(meta.get("shape", self.shape(generation)))
+        generation.load_state(meta["state"], self.memmap[meta["region"], :size], self.memmap[meta["region"], size])
+        set_rng_state(meta["rng"])
+        return meta["iteration"]
+
+    def close(self):
+        self.wait()
+        self.memmap = None
 
-rng = np.random.default_rng()
+    # deletes the checkpoint files, e.g. once the run's result is saved
+    def remove(self):
+        self.close()
+        for file in (f"{self.path}.ckpt", f"{self.path}.json"):
+            if os.path.exists(file): os.remove(file)
 
 class Generation: 
 
     # path to results folder
     path = ' '
+    # if True every fitness is computed with a full rescan of the individual and
+    # checked against the match count tracked by the swap mutations
+    verify_fitness = False
 
     # constructor takes original image's file, the number of individuals to be generated, 
     # the percentage of likeness desired, and the margin of error for 
-    # accepting individuals as solutions
-    def __init__(self, img_file, N, goal):
+    # accepting individuals as solutions (tolerance, in percentage points of fitness)
+    # if permutation is True each individual is stored as a uint32 permutation of pixel
+    # ids (positions in orig_pixels) instead of a full copy of its rgb values
+    # image is the already decoded original image (e.g. shared between batch jobs),
+    # if None it is decoded from img_file
+    # patience is the number of generations without improvement after which a run stops
+    # (None to never stop on stagnation)
+    # mask (see roi_positions) limits censoring to a region of interest: the goal, mutations,
+    # crossovers and fitness only see the pixels inside it, as if they were the whole image,
+    # and the pixels outside are copied through unchanged
+    def __init__(self, img_file, N, goal, permutation=False, image=None, tolerance=0, patience=None, mask=None):
         # original image's file
         self.orig_img_file = img_file
         # original image
-        self.orig_image = Image.open(img_file).convert('RGB')
+        self.orig_image = Image.open(img_file).convert('RGB') if image is None else image
         # width and height of all images
         self.width, self.height = self.orig_image.size
-        # number of pixels in all images
-        self.num_pixels = self.width * self.height
-        # original image's pixels stored as a 1D array (2D if considering each
-        # pixel's individual values)
-        self.orig_pixels = np.asarray(self.orig_image).reshape((self.num_pixels, 3)).astype(c_uint)
-        # original image's pixels converted to a flattened c_int_p
-        self.orig_pixels_p = self.orig_pixels.flatten().ctypes.data_as(c_int_p)
+        # pixels of the whole original image
+        self.image_pixels = np.asarray(self.orig_image).reshape((-1, 3)).astype(c_uint)
+        # positions of the region of interest in the image (None for the whole image)
+        self.roi = roi_positions(mask, self.orig_image.size)
+        # original image's pixels (inside the region of interest) stored as a 1D array (2D if
+        # considering each pixel's individual values). individuals are rearrangements of them
+        self.orig_pixels = self.image_pixels if self.roi is None else self.image_pixels[self.roi]
+        # number of pixels in all individuals
+        self.num_pixels = len(self.orig_pixels)
         # number of individuals in a population
         self.size = N
         # percentage of likeness desired
         self.goal = goal
+        # whether individuals are stored as permutations of pixel ids
+        self.permutation = permutation
+        # a run stops once best_fit <= tolerance or after patience generations without improvement
+        self.tolerance = tolerance
+        self.patience = patience
+        # observers of the generation loop's stages and the iteration being run
+        self.observers = []
+        self.iteration = 0
+        # original image's pixels packed as 0xRRGGBB, used to compare permutation individuals
+        self.orig_packed = pack_pixels(self.orig_pixels)
+        # what individuals are compared with: the packed original for permutations, else its pixels
+        self.orig = self.orig_packed if permutation else self.orig_pixels
+        # positions of the original pixels sorted by color, used to give rgb individuals pixel ids
+        self.orig_order = np.argsort(self.orig_packed, kind='stable').astype(c_uint)
+        # color class index (packed color -> positions of the original holding it), built once
+        # per image: class c holds the ids orig_order[class_start[c]:class_start[c+1]] and
+        # class_of[id] is the class of a pixel id. crossovers work on color class ordered ids
+        sorted_colors = self.orig_packed[self.orig_order]
+        starts = np.flatnonzero(np.r_[True, sorted_colors[1:] != sorted_colors[:-1]])
+        self.num_classes = len(starts)
+        self.class_start = np.append(starts, self.num_pixels).astype(c_uint)
+        self.class_of = np.empty(self.num_pixels, dtype=c_uint)
+        self.class_of[self.orig_order] = np.repeat(np.arange(self.num_classes, dtype=c_uint), np.diff(self.class_start))
+        # chance that two random positions hold different colors. it is the same for every
+        # individual (all are rearrangements of the same pixels), so the swap mutations only
+        # perform this share of their swaps, all between different colors
+        self.swap_share = 1 - float(np.sum((np.diff(self.class_start) / self.num_pixels) ** 2))
+
+    # rgb pixels of an individual. permutation individuals are only materialized here
+    def individual_pixels(self, ind):
+        return self.orig_pixels[ind] if self.permutation else ind
+
+    # pixel ids (positions in orig_pixels) of an individual. permutation individuals already
+    # are ids. rgb individuals are matched to the original by color: the k-th pixel of a
+    # color takes the position of the k-th pixel of that color in the original
+    def individual_ids(self, ind):
+        if self.permutation:
+            return ind
+        ids = np.empty(self.num_pixels, dtype=c_uint)
+        ids[np.argsort(pack_pixels(ind), kind='stable')] = self.orig_order
+        return ids
+
+    # pixel ids of an individual in color class order (see individual_ids): the k-th position
+    # holding a color gets the k-th id of that color's class, so individuals showing the same
+    # image have the same ids. permutation individuals are reordered by the kernels
+    def class_ids(self, ind):
+        if not self.permutation:
+            return self.individual_ids(ind)
+        ids = np.empty(self.num_pixels, dtype=c_uint)
+        kernels().class_ids(ind, ids, self.orig_order, self.class_of, self.class_start)
+        return ids
 
     # show the original image
     def display_original(self):
         self.orig_image.show()
 
+    # rgb pixels of the whole image showing an individual (the original outside the region of interest)
+    def image_pixels_of(self, ind):
+        return compose_roi(self.image_pixels, self.roi, self.individual_pixels(ind))
+
     # show best individual
     def display_best(self):
-        Image.fromarray(np.reshape(self.best_ind, (self.height, self.width, 3)).astype(np.uint8)).show()
+        Image.fromarray(np.reshape(self.image_pixels_of(self.best_ind), (self.height, self.width, 3)).astype(np.uint8)).show()
 
     # show a generated individual from population as an images
     def display_individual(self, ind_pos):
-        Image.fromarray(np.reshape(self.population[ind_pos], (self.height, self.width, 3)).astype(np.uint8)).show()
+        Image.fromarray(np.reshape(self.image_pixels_of(self.population[ind_pos]), (self.height, self.width, 3)).astype(np.uint8)).show()
 
     # shows all generated individuals in population as images
     def display_population(self):
         for i in range(len(self.population)): self.display_individual(i)
 
-    # prints individual using lib
+    # prints individual using the kernels
     def print_individual(self, ind_pos):
-        lib.print_individual(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), self.num_pixels)
+        kernels().print_individual(self.individual_pixels(self.population[ind_pos]))
     
-    # prints original using lib
+    # prints original using the kernels
     def print_original(self):
-        lib.print_individual(self.orig_pixels_p, self.num_pixels)  
+        kernels().print_individual(self.orig_pixels)  
     
     # generates N number of individuals for initial population
     # uses mass_swap_mutate to randomly scramble the initial population
-    def generate_population(self):
+    # start (optional) is the pixel ids of an individual to warm start from, e.g. the best
+    # individual of the previous frame of a video: every individual starts as a copy of it
+    # instead of a mass swap of the original
+    def generate_population(self, start=None):
+        self.allocate_population()
+        if start is not None:
+            start = np.asarray(start, dtype=c_uint)
+            for i in range(self.size):
+                slot = self.child_slot()
+                np.copyto(self.arena[slot], start if self.permutation else self.orig_pixels[start])
+                self.add_child(slot)
+            return
+        origin = np.arange(self.num_pixels, dtype=c_uint) if self.permutation else self.orig_pixels
+        for i in range(self.size):
+            self.population.append(origin)
+            self.slots.append(None)
+            self.matches.append(self.num_pixels)
+        for i in range(self.size):
+            self.slots[i], self.matches[i] = self.mass_swap_mutate(i)
+            self.population[i] = self.arena[self.slots[i]]
+
+    # sets up an empty population and the state of a new run
+    def allocate_population(self):
+        # preallocated buffer holding every parent and child of a generation. individuals
+        # are views into its slots and the kernels write children straight into free
+        # slots, so no memory is allocated per child across generations
+        self.arena = np.empty((2 * self.size, self.num_pixels) + (() if self.permutation else (3,)), dtype=c_uint)
+        # arena slots not used by the current population
+        self.free_slots = list(range(len(self.arena)))
         # stores best individual
-        self.best_ind = []
-        # stores fitness of best individual
-        self.best_fit = 100
+        self.best_ind = np.empty_like(self.arena[0])
+        # stores fitness of best individual. fitness can be 100 itself (a single pixel that can
+        # only match or not), so it starts above it for the first individual to be kept
+        self.best_fit = float('inf')
+        # generations since best_fit last improved
+        self.stagnant = 0
+        # whether EP mutation is mostly smart swaps and the smoothed share of mass/smart swap
+        # children that survive selection, see EP_Generation.update_phase
+        self.smart_phase = False
+        self.survival = {False: .5, True: .5}
         # population of images in the current generation
         self.population = []
+        # arena slot of each individual in the population
+        self.slots = []
+        # number of pixels of each individual matching the original, None if unknown
+        self.matches = []
+
+    # state of the run between two generations besides its individuals, for checkpoints
+    def checkpoint_state(self):
+        return {"size": self.size, "fitness": [float(fit) for fit in self.fitness[:self.size]],
+                "matches": [int(matches) for matches in self.matches[:self.size]], "best_fit": float(self.best_fit),
+                "stagnant": self.stagnant, "smart_phase": self.smart_phase,
+                "survival": [self.survival[False], self.survival[True]]}
+
+    # restores a run from a checkpoint_state, its individuals and best individual
+    def load_state(self, state, individuals, best_ind):
+        self.size = state["size"]
+        self.allocate_population()
         for i in range(self.size):
-            self.population.append(self.orig_pixels)
-            self.population[i] = self.mass_swap_mutate(i)
+            slot = self.child_slot()
+            np.copyto(self.arena[slot], individuals[i])
+            self.add_child(slot, state["matches"][i])
+        self.fitness = list(state["fitness"])
+        np.copyto(self.best_ind, best_ind)
+        self.best_fit = state["best_fit"]
+        self.stagnant = state["stagnant"]
+        self.smart_phase = state["smart_phase"]
+        self.survival = {False: state["survival"][0], True: state["survival"][1]}
 
-    # evaluates the fitness of an individual in the population using lib
+    # counts the generations since best_fit improved, given best_fit before the generation
+    def track_progress(self, best_before):
+        self.stagnant = 0 if self.best_fit < best_before else self.stagnant + 1
+
+    # True once best_fit is within tolerance or has stagnated for patience generations
+    def finished(self):
+        return self.best_fit <= self.tolerance or (self.patience is not None and self.stagnant >= self.patience)
+
+    # runs up to iterations generations, stopping early once finished
+    # with a Checkpoint the run resumes from its latest checkpoint and is checkpointed as it goes
+    # returns the number of generations run (including those before a resume)
+    def run(self, iterations, checkpoint=None):
+        start = 0 if checkpoint is None else checkpoint.restore(self)
+        if start > 0 and self.finished(): return start
+        for i in range(start, iterations):
+            self.next_generation(i, iterations)
+            if self.finished() or i + 1 == iterations:
+                if checkpoint is not None:
+                    checkpoint.save(self, i + 1)
+                    checkpoint.wait()
+                return i + 1
+            if checkpoint is not None: checkpoint.save_every(self, i + 1)
+        return iterations
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    # runs op(*args) as a stage of the generation loop, reporting it to the observers
+    # without observers this is a plain call
+    def run_stage(self, stage, op, *args):
+        if not self.observers: return op(*args)
+        for observer in self.observers: observer.start_stage(self, stage)
+        allocated = kernels().allocated_bytes()
+        start_time = time.perf_counter()
+        result = op(*args)
+        seconds = time.perf_counter() - start_time
+        fitness = np.asarray(self.fitness, dtype=float)
+        record = {"iteration": self.iteration, "stage": stage, "seconds": seconds,
+                  "c_bytes": kernels().allocated_bytes() - allocated, "population": len(self.population),
+                  "evaluated": len(fitness),
+                  "best_fit": float(fitness.min()) if len(fitness) else None,
+                  "mean_fit": float(fitness.mean()) if len(fitness) else None,
+                  "std_fit": float(fitness.std()) if len(fitness) else None}
+        for observer in self.observers: observer.end_stage(self, stage, record)
+        return result
+
+    # evaluates every individual of the population that has no fitness yet (new children)
+    def evaluate_children(self):
+        for i in range(len(self.fitness), len(self.population)):
+            self.evaluate_fitness(i)
+
+    # takes a free arena slot for a new child
+    def child_slot(self):
+        return self.free_slots.pop()
+
+    # adds the child written into an arena slot to the population with its number of
+    # matching pixels (None if unknown, e.g. after crossover)
+    def add_child(self, slot, matches=None):
+        self.population.append(self.arena[slot])
+        self.slots.append(slot)
+        self.matches.append(matches)
+
+    # overwrites an individual with a copy of ind (e.g. a migrant from another island)
+    def replace_individual(self, ind_pos, ind, matches):
+        np.copyto(self.population[ind_pos], ind)
+        self.matches[ind_pos] = int(matches)
+        self.fitness[ind_pos] = abs(matches / self.num_pixels * 100 - self.goal)
+        if self.fitness[ind_pos] < self.best_fit:
+            np.copyto(self.best_ind, ind)
+            self.best_fit = self.fitness[ind_pos]
+
+    # frees the arena slots of individuals that did not survive selection
+    def release_slots(self):
+        used = set(self.slots)
+        self.free_slots = [s for s in range(len(self.arena)) if s not in used]
+
+    # counts the pixels of an individual matching the original with a full rescan using the kernels
+    def count_matches(self, ind_pos):
+        return kernels().count_matches(self.population[ind_pos], self.orig)
+
+    # evaluates the fitness of an individual in the population
     # fitness is how close the percentage of likeness an image (to the original)
     # is to the goal percentage of likeness
+    # O(1) when the individual's match count is already tracked, otherwise rescans using the kernels
     def evaluate_fitness(self, ind_pos):
-        fit = lib.evaluate_fitness(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), self.orig_pixels_p, c_double(self.goal), self.num_pixels)
+        matches = self.matches[ind_pos]
+        if matches is None or self.verify_fitness:
+            scanned = self.count_matches(ind_pos)
+            if matches is not None and matches != scanned:
+                raise RuntimeError(f"individual {ind_pos} tracked {matches} matching pixels but has {scanned}")
+            matches = self.matches[ind_pos] = scanned
+        fit = abs(matches / self.num_pixels * 100 - self.goal)
         if fit < self.best_fit:
-            self.best_ind = self.population[ind_pos]
+            np.copyto(self.best_ind, self.population[ind_pos])
             self.best_fit = fit
         self.fitness.append(fit)
 
-    # evaluates the fitness of each individual in the population using lib
+    # evaluates a whole population stored as one contiguous array with a single kernel call
+    # population is (num_inds, num_pixels) for permutations or (num_inds, num_pixels, 3) for rgb
+    # matches (optional) receives the number of matching pixels of each individual
+    # returns the fitness of every individual and updates best_ind/best_fit. fitness is float64
+    # as in evaluate_fitness, so equal match counts always give equal fitness
+    def evaluate_batch(self, population, matches=None):
+        population = np.ascontiguousarray(population, dtype=c_uint)
+        if matches is None:
+            matches = np.empty(len(population), dtype=c_int)
+        kernels().batch_count_matches(population, self.orig, matches)
+        fitness = np.abs(matches / self.num_pixels * 100 - self.goal)
+        best = int(np.argmin(fitness))
+        if fitness[best] < self.best_fit:
+            np.copyto(self.best_ind, population[best])
+            self.best_fit = float(fitness[best])
+        return fitness
+
+    # evaluates the fitness of each individual in the population using one batched kernel call
     def evaluate_population(self):
+        matches = np.empty(self.size, dtype=c_int)
         # fitnesses of individuals in the current generation
         # goal is to be minimized
-        self.fitness = []
-        for i in range(self.size): self.evaluate_fitness(i)
+        self.fitness = self.evaluate_batch(self.arena[self.slots[:self.size]], matches).tolist()
+        if self.verify_fitness:
+            for i in range(self.size):
+                if self.matches[i] is not None and self.matches[i] != matches[i]:
+                    raise RuntimeError(f"individual {i} tracked {self.matches[i]} matching pixels but has {matches[i]}")
+        self.matches[:self.size] = matches.tolist()
+
+    # round-robin tournament over the first num_inds individuals, vectorized with numpy
+    # each individual faces q distinct opponents drawn at once from the first num_opps
+    # individuals (never itself). the fitter individual wins with chance % (int 0-100),
+    # ties are a coin flip. returns the wins of each individual
+    def count_wins(self, num_inds, num_opps, q, chance):
+        # small populations face every possible opponent
+        q = min(q, num_opps - 1)
+        opps = self.draw_opponents(num_inds, num_opps, q)
+        fit = np.asarray(self.fitness[:max(num_inds, num_opps)])
+        ind_fit = fit[:num_inds, None]
+        opp_fit = fit[opps]
+        fitter_wins = rng.random(opps.shape) * 100 < chance
+        won = np.where(ind_fit < opp_fit, fitter_wins,
+                       np.where(ind_fit > opp_fit, ~fitter_wins, rng.random(opps.shape) < .5))
+        return won.sum(axis=1)
+
+    # draws q distinct opponents for each of the first num_inds individuals from the first
+    # num_opps individuals in one batch: every row ranks the opponents by a random key and
+    # takes the q lowest. an individual is never its own opponent, its key is infinite
+    def draw_opponents(self, num_inds, num_opps, q):
+        if q < 1: return np.empty((num_inds, 0), dtype=np.intp)
+        keys = rng.random((num_inds, num_opps))
+        own = np.arange(min(num_inds, num_opps))
+        keys[own, own] = np.inf
+        return np.argpartition(keys, q - 1, axis=1)[:, :q]
+
+    # positions of individuals sorted by most wins, ties keep population order
+    def rank_wins(self):
+        return np.argsort(-self.wins, kind='stable')
 
     # mutation that swaps a random number of pixels (up to amount of pixels in image)
-    def mass_swap_mutate(self, ind_pos):
-        return np.ctypeslib.as_array(lib.mass_swap(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), int(rd.random() * 1000), self.num_pixels), shape=(self.num_pixels, 3))
+    # writes the child into slot (a free arena slot if None)
+    # returns the child's slot and its number of matching pixels
+    def mass_swap_mutate(self, ind_pos, slot=None):
+        if slot is None: slot = self.child_slot()
+        matches = kernels().mass_swap(self.population[ind_pos], self.arena[slot], self.orig, self.matches[ind_pos],
+                                      next_stream(), self.swap_share)
+        return slot, matches
     
     # swap mutation that swaps up to double the number of pixels needed to change (fitness)
     # if the fitness is very close to 0, only mutate 1 / 3 pixels
-    def smart_swap_mutate(self, ind_pos):
+    # an individual not evaluated yet (a crossover child) takes its fitness from its match count
+    def smart_swap_mutate(self, ind_pos, slot=None):
+        if slot is None: slot = self.child_slot()
+        if ind_pos < len(self.fitness): fitness = self.fitness[ind_pos]
+        else: fitness = abs(self.matches[ind_pos] / self.num_pixels * 100 - self.goal)
         try:
-            max_pixels = self.num_pixels / self.fitness[ind_pos] * 2
+            max_pixels = self.num_pixels / fitness * 2
         except ZeroDivisionError:
             max_pixels = self.num_pixels / 3
-        return np.ctypeslib.as_array(lib.smart_swap(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), int(rd.random() * 1000), int(max_pixels), self.num_pixels), shape=(self.num_pixels, 3))
+        matches = kernels().smart_swap(self.population[ind_pos], self.arena[slot], self.orig, self.matches[ind_pos],
+                                       next_stream(), int(min(max_pixels, self.num_pixels)), self.swap_share)
+        return slot, matches
 
     """# swap mutation that can only swap up to 10% of the total number of pixels
     def small_swap_mutate(self, ind_pos):
-        return np.ctypeslib.as_array(lib.smart_swap(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), int(rd.random() * 1000), int(self.num_pixels * .5), self.num_pixels), shape=(self.num_pixels, 3))
+        return np.ctypeslib.as_array(lib.smart_swap(self.population[ind_pos].flatten().ctypes.data_as(c_int_p), next_stream(), int(self.num_pixels * .5), self.num_pixels), shape=(self.num_pixels, 3))
     """
-    def save_results(self):
-        Image.fromarray(np.reshape(self.best_ind, (self.height, self.width, 3)).astype(np.uint8)).save(f'{self.path}/{self.goal} +- {self.best_fit:.4f}%.png')
+    # best individual as a compact result (its pixel ids and metadata)
+    def compact_result(self):
+        return Compact_Result({"width": self.width, "height": self.height, "goal": self.goal, "fit": float(self.best_fit)},
+                              roi_ids(self.roi, self.individual_ids(self.best_ind), len(self.image_pixels)))
 
-    def create_folder_and_save(self, algorithm):
+    # saves the best individual as a PNG, or as a compact result file if compact
+    # saves the best individual as a PNG, or as a compact result file if compact, and returns
+    # the file. run (if not None) is part of the file's name, see result_file_name
+    def save_results(self, compact=False, run=None):
+        self.file = f"{self.path}/{result_file_name(self.goal, self.best_fit, compact, run)}"
+        if compact:
+            self.compact_result().save(self.file)
+            return self.file
+        image = Image.fromarray(np.reshape(self.image_pixels_of(self.best_ind), (self.height, self.width, 3)).astype(np.uint8))
+        write_atomically(self.file, lambda f: image.save(f, format='PNG'))
+        return self.file
+
+    def create_folder_and_save(self, algorithm, compact=False, run=None):
         # create directory for results if one doesnt exist
-        self.path = f"{results_folder}/{self.orig_img_file.replace('./images/', '').replace('.png', ' results')}"
-        if not os.path.exists(self.path): 
-            os.mkdir(self.path)
-        self.path = f"{self.path}/{algorithm}"
-        if not os.path.exists(self.path):
-            os.mkdir(self.path)
-        self.path = f"{self.path}/{self.goal}%"
-        if not os.path.exists(self.path):
-            os.mkdir(self.path)
-        self.save_results()
+        # (exist_ok so parallel batch jobs can create the same folders)
+        self.path = f"{results_folder}/{os.path.basename(self.orig_img_file).replace('.png', ' results')}/{algorithm}/{self.goal}%"
+        os.makedirs(self.path, exist_ok=True)
+        return self.save_results(compact, run)
 
 class EP_Generation(Generation):
     # stores sorted pos
@@ -153,61 +1094,67 @@ class EP_Generation(Generation):
     wins: {self.wins[self.sorted_pos[i]]}""")
         print()
 
-    # generates children and adds them to the population
-    # also performs repairs on children
-    # takes number of iterations to decide which mutations to perform
+    # generates children, adds them to the population and evaluates them
     def generate_children(self, iters, total_iters):
-        if iters < 3 * total_iters / 5:
-            for i in range(self.size):
-                self.population.append(self.mass_swap_mutate(i) if rd.randint(0,11) <= 8 else self.smart_swap_mutate(i))
-                self.evaluate_fitness(self.size)
-                self.size += 1
-        else:
-            for i in range(self.size):
-                self.population.append(self.smart_swap_mutate(i) if rd.randint(0,11) <= 8 else self.mass_swap_mutate(i))
-                self.evaluate_fitness(self.size)
-                self.size += 1
+        self.run_stage("mutation", self.mutate_parents, iters, total_iters)
+        self.run_stage("evaluation", self.evaluate_children)
+        self.size = len(self.population)
+
+    # adds a mutated copy of every parent to the population, mostly with the mutation whose
+    # children have been surviving more often (smart_phase)
+    # child_ops records whether each child was made by a smart swap
+    def mutate_parents(self, iters, total_iters):
+        self.child_ops = []
+        for i in range(self.size):
+            smart = (rng.integers(12) <= 8) == self.smart_phase
+            self.add_child(*(self.smart_swap_mutate(i) if smart else self.mass_swap_mutate(i)))
+            self.child_ops.append(smart)
+
+    # measures the share of mass and smart swap children that won a place among the
+    # survivors (smoothed over generations) and makes the more successful one the main
+    # mutation, so the phase switch follows the run's progress instead of its iteration
+    def update_phase(self):
+        parents = self.size // 2
+        ops = np.asarray(self.child_ops)
+        survivors = np.asarray(self.sorted_pos[:parents])
+        survived = np.zeros(parents, dtype=bool)
+        survived[survivors[survivors >= parents] - parents] = True
+        for smart in (False, True):
+            if np.any(ops == smart):
+                self.survival[smart] = .8 * self.survival[smart] + .2 * survived[ops == smart].mean()
+        if self.survival[True] != self.survival[False]:
+            self.smart_phase = bool(self.survival[True] > self.survival[False])
 
     # round-robin tournament to assign wins to each individual
     # sets q: q = number of opponents to face
     # sets chance: chance of better individual winning (int 0-100)
     def round_robin(self, q, chance):
         self.q = q
-        self.wins = []
-        #self.wins = lib.round_robin(np.asarray(self.fitness[:self.size]).ctypes.data_as(c_float_p), self.size, int(rd.random()*1000000), q, chance)
-        for i in range(self.size): 
-            pos_used = []
-            self.wins.append(0)
-            for r in range(q):
-                opp = i
-                used = True
-                while used:
-                    opp = rd.randrange(self.size)
-                    if opp is not i:
-                        found = False
-                        for u in range(r):
-                            if pos_used[u] == opp: 
-                                found = True
-                                u = r
-                        used = found
-                if self.fitness[i] < self.fitness[opp]: self.wins[i] += 1
-                elif self.fitness[i] == self.fitness[opp]:
-                    if rd.randrange(2) == 0: self.wins[i] += 1
-                pos_used.append(opp)
+        self.wins = self.count_wins(self.size, self.size, q, chance)
 
     # sorts individuals by wins and stores sorted positions
     def sort_wins(self):
-        self.sorted_pos = []
-        for i in range(self.q, -1, -1):
-            for k in range(self.size):
-                if self.wins[k] == i: 
-                    self.sorted_pos.append(k)
+        self.sorted_pos = self.rank_wins()
 
     # survivor selection: takes top N individuals to survive on
     def survivor_select(self):
         self.size = int(self.size / 2)
         self.population = [self.population[self.sorted_pos[i]] for i in range(self.size)]
         self.fitness = [self.fitness[self.sorted_pos[i]] for i in range(self.size)]
+        self.matches = [self.matches[self.sorted_pos[i]] for i in range(self.size)]
+        self.slots = [self.slots[self.sorted_pos[i]] for i in range(self.size)]
+        self.release_slots()
+
+    # runs one generation: mutation, then round-robin survivor selection
+    def next_generation(self, iters, total_iters, q=7, chance=80):
+        self.iteration = iters
+        best_before = self.best_fit
+        self.generate_children(iters, total_iters)
+        self.run_stage("tournament", self.round_robin, q, chance)
+        self.run_stage("sort", self.sort_wins)
+        self.update_phase()
+        self.run_stage("selection", self.survivor_select)
+        self.track_progress(best_before)
 
 # steady state GA
 class GA_Generation(Generation):
@@ -216,11 +1163,35 @@ class GA_Generation(Generation):
     # contains individuals that will survive
     survivor_pool = []
     
+    # if True every crossover child is checked to be a valid permutation of its parents
+    verify_crossover = False
+
+    # runs a crossover kernel on the color class ordered pixel ids of two parents and
+    # adds the child to the population. rgb children are materialized from the child's ids
+    def crossover(self, cross, p1_pos, p2_pos, *args):
+        slot = self.child_slot()
+        ids_1 = self.class_ids(self.population[p1_pos])
+        ids_2 = self.class_ids(self.population[p2_pos])
+        child = self.arena[slot] if self.permutation else np.empty(self.num_pixels, dtype=c_uint)
+        cross(ids_1, ids_2, child, next_stream(), *args)
+        if not self.permutation:
+            np.take(self.orig_pixels, child, axis=0, out=self.arena[slot])
+        self.add_child(slot)
+        if self.verify_crossover and not self.valid_child(len(self.population) - 1, p1_pos, p2_pos):
+            raise RuntimeError(f"crossover of individuals {p1_pos} and {p2_pos} is not a permutation of its parents")
+
+    # checks that an individual holds exactly the pixels of its parents, rearranged
+    def valid_child(self, ind_pos, p1_pos, p2_pos):
+        child = self.population[ind_pos]
+        if self.permutation:
+            return bool(np.all(np.bincount(child, minlength=self.num_pixels) == 1))
+        colors = np.sort(pack_pixels(child))
+        return (np.array_equal(colors, np.sort(pack_pixels(self.population[p1_pos]))) and
+                np.array_equal(colors, np.sort(pack_pixels(self.population[p2_pos]))))
+
     # PMX crossover
     def pmx_cross(self, p1_pos, p2_pos):
-        self.population.append(lib.pmx_cross(self.population[p1_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.population[p2_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.num_pixels))
+        self.crossover(kernels().pmx_cross, p1_pos, p2_pos)
 
     # PMX crossover where the max range of the crossover is up to double 
     # the number of pixels needed to reach the goal percentage from the average of the 
@@ -229,44 +1200,49 @@ class GA_Generation(Generation):
         try:
             avg_fit = (self.fitness[p1_pos] + self.fitness[p2_pos]) / 2
             max_pixels = self.num_pixels / avg_fit * 2
-            self.population.append(lib.smart_pmx_cross(self.population[p1_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.population[p2_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.num_pixels, int(max_pixels)))
+            self.crossover(kernels().pmx_cross, p1_pos, p2_pos, int(min(max_pixels, self.num_pixels)))
         except ZeroDivisionError:
             self.order_cross(p1_pos, p2_pos)
 
     def order_cross(self, p1_pos, p2_pos):
-        self.population.append(lib.order_cross(self.population[p1_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.population[p2_pos].flatten().ctypes.data_as(c_int_p), 
-                              self.num_pixels))
+        self.crossover(kernels().order_cross, p1_pos, p2_pos)
 
     # parent selection: tournament with k opponents  
     # stochastic with fitter individuals have 80% chance of winning
     # once two winners are selected, Smart PMX crossover
     def tournament_select(self, k):
-        fit_p = np.asarray(self.fitness[:self.size]).ctypes.data_as(c_float_p)
+        fit = np.asarray(self.fitness[:self.size], dtype=c_float)
         for i in range(self.size):
-            pos_1 = lib.tournament_select(fit_p, k, self.size)
-            pos_2 = lib.tournament_select(fit_p, k, self.size)
-            self.population.append(self.smart_pmx_cross(pos_1, pos_2))
-        del fit_p
+            pos_1 = kernels().tournament_select(fit, k, next_stream())
+            pos_2 = kernels().tournament_select(fit, k, next_stream())
+            # crossover appends the child to the population
+            self.smart_pmx_cross(pos_1, pos_2)
 
+    # mutates the crossover children and evaluates them
     def mutate_children(self):
-        for i in range(self.size):
-            self.population[self.size+i] = self.smart_swap_mutate(i)
-            self.evaluate_fitness(self.size+i)
+        self.run_stage("mutation", self.mutate_offspring)
+        self.run_stage("evaluation", self.evaluate_children)
+
+    # mutates every crossover child in place. its match count is counted once after the
+    # crossover, the swap kernels then keep it up to date through the swaps
+    def mutate_offspring(self):
+        for i in range(self.size, 2 * self.size):
+            self.matches[i] = self.count_matches(i)
+            _, self.matches[i] = self.smart_swap_mutate(i, self.slots[i])
 
     # does not allow duplicates
     def tournament_survive(self, k):
-        fit_p = np.asarray(self.fitness[:self.size]).ctypes.data_as(c_float_p)
+        fit = np.asarray(self.fitness[:self.size], dtype=c_float)
         survivors = []
         for i in range(self.size): 
-            survivor = lib.tournament_select(fit_p, k, self.size)
-            while survivor in survivors: survivor = lib.tournament_select(fit_p, k, self.size)
+            survivor = kernels().tournament_select(fit, k, next_stream())
+            while survivor in survivors: survivor = kernels().tournament_select(fit, k, next_stream())
             survivors.append(survivor)
         self.population = [self.population[survivors[i]] for i in range(self.size)]
         self.fitness = [self.fitness[survivors[i]] for i in range(self.size)]
-        del fit_p
+        self.matches = [self.matches[survivors[i]] for i in range(self.size)]
+        self.slots = [self.slots[survivors[i]] for i in range(self.size)]
+        self.release_slots()
         del survivors
 
         # round-robin tournament to assign wins to each individual
@@ -275,41 +1251,31 @@ class GA_Generation(Generation):
     # sets chance: chance of better individual winning (int 0-100)
     def round_robin(self, q, chance):
         self.q = q
-        self.wins = []
-        #self.wins = lib.round_robin(np.asarray(self.fitness[:self.size]).ctypes.data_as(c_float_p), self.size, int(rd.random()*1000000), q, chance)
-        for i in range(self.size*2): 
-            pos_used = []
-            self.wins.append(0)
-            for r in range(q):
-                opp = i
-                used = True
-                while used:
-                    opp = rd.randrange(self.size)
-                    if opp is not i:
-                        found = False
-                        for u in range(r):
-                            if pos_used[u] == opp: 
-                                found = True
-                                u = r
-                        used = found
-                if self.fitness[i] < self.fitness[opp]: self.wins[i] += 1
-                elif self.fitness[i] == self.fitness[opp]:
-                    if rd.randrange(2) == 0: self.wins[i] += 1
-                pos_used.append(opp)
-
-    # sorts individuals by wins and stores sorted positions using lib
+        # parents and children face opponents among the parents
+        self.wins = self.count_wins(self.size*2, self.size, q, chance)
+
+    # sorts individuals by wins and stores sorted positions
     def sort_wins(self):
-        #self.sorted_pos = lib.sort_wins(np.asarray(self.wins).ctypes.data_as(c_int_p), len(self.wins), self.q)
-        self.sorted_pos = []
-        for i in range(self.q, -1, -1):
-            for k in range(self.size*2):
-                if self.wins[k] == i: 
-                    self.sorted_pos.append(k)
+        self.sorted_pos = self.rank_wins()
 
     # survivor selection: takes top N individuals to survive on
     def survivor_select(self):
         self.population = [self.population[self.sorted_pos[i]] for i in range(self.size)]
         self.fitness = [self.fitness[self.sorted_pos[i]] for i in range(self.size)]
+        self.matches = [self.matches[self.sorted_pos[i]] for i in range(self.size)]
+        self.slots = [self.slots[self.sorted_pos[i]] for i in range(self.size)]
+        self.release_slots()
+
+    # runs one generation: selection & crossover, mutation, then round-robin survivor selection
+    def next_generation(self, iters, total_iters, k=3, q=7, chance=80):
+        self.iteration = iters
+        best_before = self.best_fit
+        self.run_stage("crossover", self.tournament_select, k)
+        self.mutate_children()
+        self.run_stage("tournament", self.round_robin, q, chance)
+        self.run_stage("sort", self.sort_wins)
+        self.run_stage("selection", self.survivor_select)
+        self.track_progress(best_before)
   
 class Greedy_Solution():
     # path to results folder
@@ -318,17 +1284,26 @@ class Greedy_Solution():
     # constructor takes original image's file, the number of individuals to be generated, 
     # the percentage of likeness desired, and the margin of error for 
     # accepting individuals as solutions
-    def __init__(self, img_file, goal):
+    # image is the already decoded original image, if None it is decoded from img_file
+    # mask (see roi_positions) limits censoring to a region of interest, as for Generation
+    def __init__(self, img_file, goal, image=None, mask=None):
         # original image's file
         self.orig_img_file = img_file
         # original image
-        self.orig_image = Image.open(img_file).convert('RGB')
+        self.orig_image = Image.open(img_file).convert('RGB') if image is None else image
         # width and height of all images
         self.width, self.height = self.orig_image.size
-        # number of pixels in all image
-        self.num_pixels = self.width * self.height
-        # original image's pixels stored as a 1D array (2D if considering each pixel's individual values)
-        self.orig_pixels = np.asarray(self.orig_image).reshape((self.num_pixels, 3)).astype(c_uint)
+        # pixels of the whole original image
+        self.image_pixels = np.asarray(self.orig_image).reshape((-1, 3)).astype(c_uint)
+        # positions of the region of interest in the image (None for the whole image)
+        self.roi = roi_positions(mask, self.orig_image.size)
+        # original image's pixels (inside the region of interest) stored as a 1D array (2D if
+        # considering each pixel's individual values)
+        self.orig_pixels = self.image_pixels if self.roi is None else self.image_pixels[self.roi]
+        # number of pixels in the solution
+        self.num_pixels = len(self.orig_pixels)
+        # original image's pixels packed as 0xRRGGBB
+        self.orig_packed = pack_pixels(self.orig_pixels)
         # percentage of likeness desired
         self.goal = goal
 
@@ -336,32 +1311,469 @@ class Greedy_Solution():
     # alone (not moved) is the goal %. If the position is to be changed it is swapped with a
     # pixel in from an unused location 
     def greedy_generate(self):
-        self.solution = np.ctypeslib.as_array(lib.greedy_generate(self.orig_pixels.flatten().ctypes.data_as(c_int_p), c_double(self.goal), int(rd.random() * 1000), self.num_pixels), shape=(self.num_pixels, 3))
+        self.solution = np.empty_like(self.orig_pixels)
+        kernels().greedy_generate(self.orig_pixels, self.solution, self.goal, next_stream())
+        # the greedy solution may repeat pixels, so it has no pixel ids
+        self.solution_ids = None
     
-    # evaluates the fitness of an individual in the population using lib
+    # generates a solution with exactly round(goal * num_pixels) pixels left in place in one
+    # vectorized pass. the fixed positions are picked at random and the rest are deranged
+    # by color: displaced positions are sorted into color classes (in random order) and each
+    # takes the pixel of the position max_class places before it, so no displaced position
+    # gets back a pixel of its own color as long as no color holds more than half of them
+    def exact_generate(self):
+        num_fixed = round(self.goal / 100 * self.num_pixels)
+        order = rng.permutation(self.num_pixels)
+        fixed, displaced = order[:num_fixed], order[num_fixed:]
+        if len(displaced) > 1:
+            colors, classes, counts = np.unique(self.orig_packed[displaced], return_inverse=True, return_counts=True)
+            dominant = int(np.argmax(counts))
+            # a color holding more than half of the displaced positions cannot be deranged:
+            # trade some of them for fixed positions of other colors
+            excess = -(-(2 * int(counts[dominant]) - len(displaced)) // 2)
+            if excess > 0:
+                take = np.flatnonzero(classes == dominant)[:excess]
+                give = np.flatnonzero(self.orig_packed[fixed] != colors[dominant])[:len(take)]
+                take = take[:len(give)]
+                fixed[give], displaced[take] = displaced[take], fixed[give].copy()
+                colors, classes, counts = np.unique(self.orig_packed[displaced], return_inverse=True, return_counts=True)
+            # displaced is already shuffled, so positions stay in random order within a class
+            displaced = displaced[np.argsort(rng.permutation(len(colors))[classes], kind='stable')]
+        # pixel ids of the solution: fixed positions keep their pixel
+        self.solution_ids = np.arange(self.num_pixels)
+        if len(displaced) > 1:
+            self.solution_ids[displaced] = np.roll(displaced, int(counts.max()))
+        self.solution = self.orig_pixels[self.solution_ids]
+
+    # exact solutions for every goal of goals from a single random order of the positions:
+    # each goal leaves the first round(goal * num_pixels) positions of the order in place, so
+    # a higher goal's fixed pixels are a superset of a lower goal's, and derange the rest by
+    # color as exact_generate does. the sort into color classes is done once for the whole
+    # order, each goal only filters it. returns {goal: solution}, also kept in goal_solutions
+    def multi_generate(self, goals):
+        order = rng.permutation(self.num_pixels)
+        colors, classes, counts = np.unique(self.orig_packed, return_inverse=True, return_counts=True)
+        classes = classes.reshape(-1)
+        # the order sorted into color classes (in random order), shuffled within a class
+        class_order = order[np.argsort(rng.permutation(len(colors))[classes[order]], kind='stable')]
+        goal_solutions = {}
+        for goal in sorted(goals):
+            num_fixed = round(goal / 100 * self.num_pixels)
+            fixed = np.zeros(self.num_pixels, dtype=bool)
+            fixed[order[:num_fixed]] = True
+            displaced_counts = np.bincount(classes[order[num_fixed:]], minlength=len(colors))
+            dominant = int(np.argmax(displaced_counts))
+            # a color holding more than half of the displaced positions cannot be deranged: fix
+            # its next positions in the order and displace the last fixed positions of other
+            # colors instead. both only move along the order, which keeps the goals nested
+            excess = -(-(2 * int(displaced_counts[dominant]) - (self.num_pixels - num_fixed)) // 2)
+            if excess > 0:
+                is_dominant = classes[order] == dominant
+                take = order[num_fixed:][is_dominant[num_fixed:]][:excess]
+                give = order[:num_fixed][~is_dominant[:num_fixed]][::-1][:len(take)]
+                take = take[:len(give)]
+                fixed[take], fixed[give] = True, False
+                displaced_counts[dominant] -= len(take)
+                np.add.at(displaced_counts, classes[give], 1)
+            displaced = class_order[~fixed[class_order]]
+            ids = np.arange(self.num_pixels)
+            if len(displaced) > 1:
+                ids[displaced] = np.roll(displaced, int(displaced_counts.max()))
+            solution = copy.copy(self)
+            solution.goal = goal
+            solution.apply_ids(ids)
+            solution.evaluate_fitness()
+            goal_solutions[goal] = solution
+        self.goal_solutions = goal_solutions
+        return goal_solutions
+
+    # saves the solution of every goal of multi_generate to its goal's folder
+    def create_folders_and_save_goals(self, algorithm, compact=False):
+        for solution in self.goal_solutions.values():
+            solution.create_folder_and_save(algorithm, compact)
+        return [solution.path for solution in self.goal_solutions.values()]
+
+    # uses the pixel ids of another solution (e.g. of the previous frame of a video)
+    def apply_ids(self, ids):
+        self.solution_ids = np.asarray(ids)
+        self.solution = self.orig_pixels[self.solution_ids]
+
+    # evaluates the fitness of an individual in the population using the kernels
     # fitness is how close the percentage of likeness an image (to the original)
     # is to the goal percentage of likeness
     def evaluate_fitness(self):
-        self.fit = lib.evaluate_fitness(self.solution.flatten().ctypes.data_as(c_int_p), self.orig_pixels.flatten().ctypes.data_as(c_int_p), c_double(self.goal), self.num_pixels)
+        self.fit = kernels().evaluate_fitness(self.solution, self.orig_pixels, self.goal)
 
     def print_solution(self):
-        lib.print_individual(self.solution.flatten().ctypes.data_as(c_int_p), self.num_pixels)
+        kernels().print_individual(self.solution)
+
+    # rgb pixels of the whole image showing the solution (the original outside the region of interest)
+    def result_pixels(self):
+        return compose_roi(self.image_pixels, self.roi, self.solution)
 
     def display_result(self):
-        Image.fromarray(np.reshape(self.solution, (self.height, self.width, 3)).astype(np.uint8)).show()
+        Image.fromarray(np.reshape(self.result_pixels(), (self.height, self.width, 3)).astype(np.uint8)).show()
+
+    # solution as a compact result. a greedy_generate solution has no ids of its own: every
+    # pixel gets its own position if it kept its color, else the first id of its color
+    def compact_result(self):
+        meta = {"width": self.width, "height": self.height, "goal": self.goal, "fit": float(self.fit)}
+        ids = getattr(self, 'solution_ids', None)
+        if ids is None:
+            packed = pack_pixels(self.solution)
+            order = np.argsort(self.orig_packed, kind='stable')
+            first = order[np.searchsorted(self.orig_packed[order], packed)]
+            ids = np.where(packed == self.orig_packed, np.arange(self.num_pixels), first)
+        return Compact_Result(meta, roi_ids(self.roi, ids, len(self.image_pixels)))
+
+    # saves the solution as a PNG, or as a compact result file if compact, and returns the file
+    # run (if not None) is part of the file's name, see result_file_name
+    def save_result(self, compact=False, run=None):
+        self.file = f"{self.path}/{result_file_name(self.goal, self.fit, compact, run)}"
+        if compact:
+            self.compact_result().save(self.file)
+            return self.file
+        image = Image.fromarray(np.reshape(self.result_pixels(), (self.height, self.width, 3)).astype(np.uint8))
+        write_atomically(self.file, lambda f: image.save(f, format='PNG'))
+        return self.file
+
+    def create_folder_and_save(self, algorithm, compact=False, run=None):
+        # create directory for results if one doesnt exist
+        # (exist_ok so parallel batch jobs can create the same folders)
+        self.path = f"{results_folder}/{os.path.basename(self.orig_img_file).replace('.png', ' results')}/{algorithm}/{self.goal}%"
+        os.makedirs(self.path, exist_ok=True)
+        return self.save_result(compact, run)
+
+# island model: runs num_islands independent EP or GA sub-populations in a process pool,
+# each on its own core. every migrate_every generations each island sends copies of its
+# best migrants individuals through shared memory to the next island in a ring, where
+# they replace the worst individuals
+class Island_Model():
+
+    # constructor takes the Generation class to run (EP_Generation or GA_Generation), the
+    # original image's file, the number of individuals per island, the percentage of likeness
+    # desired, whether individuals are stored as permutations, the number of islands, how
+    # many generations pass between migrations and how many individuals migrate
+    def __init__(self, generation_class, img_file, N, goal, permutation=False, num_islands=os.cpu_count(),
+                 migrate_every=10, migrants=2, seed=None):
+        self.generation_class = generation_class
+        self.img_file = img_file
+        self.size = N
+        self.goal = goal
+        self.permutation = permutation
+        self.num_islands = num_islands
+        self.migrate_every = migrate_every
+        self.migrants = min(migrants, N)
+        # island i draws from the streams of worker i of seed
+        self.seed = int(np.random.SeedSequence().entropy % 2**63) if seed is None else seed
+        # holds the original image and, after run, the global best individual and its fitness
+        self.result = generation_class(img_file, N, goal, permutation)
+
+    # runs iterations generations on every island and returns the global best_ind/best_fit
+    def run(self, iterations):
+        ind_shape = self.result.orig_packed.shape if self.permutation else self.result.orig_pixels.shape
+        ind_bytes = int(np.prod(ind_shape)) * np.dtype(c_uint).itemsize
+        # one row of migrants per island plus one row for each island's final best individual
+        shm = shared_memory.SharedMemory(create=True, size=self.num_islands * (self.migrants + 1) * ind_bytes)
+        migration = shared_memory.SharedMemory(create=True, size=self.num_islands * self.migrants * np.dtype(c_int).itemsize)
+        try:
+            barrier = mp.Barrier(self.num_islands)
+            with mp.Pool(self.num_islands, initializer=init_island, initargs=(barrier,)) as pool:
+                # islands get plain settings, each decodes the image itself
+                settings = (self.generation_class, self.img_file, self.size, self.goal, self.permutation,
+                            self.num_islands, self.migrate_every, self.migrants, self.seed)
+                best_fits = pool.starmap(run_island, [(island, settings, iterations, shm.name, migration.name, ind_shape)
+                                                      for island in range(self.num_islands)])
+            best = int(np.argmin(best_fits))
+            individuals = np.ndarray((self.num_islands, self.migrants + 1) + ind_shape, dtype=c_uint, buffer=shm.buf)
+            self.result.best_ind = individuals[best, self.migrants].copy()
+            self.result.best_fit = best_fits[best]
+            del individuals
+        finally:
+            shm.close()
+            shm.unlink()
+            migration.close()
+            migration.unlink()
+        return self.result.best_ind, self.result.best_fit
+
+# yields the frames of source as RGB PIL images, decoding each one only when it is asked for
+# source is a folder of frames (read in file name order) or an animated image (GIF, APNG, ...)
+def read_frames(source):
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
+                with Image.open(os.path.join(source, name)) as frame:
+                    yield frame.convert('RGB')
+    else:
+        with Image.open(source) as image:
+            for i in range(getattr(image, 'n_frames', 1)):
+                image.seek(i)
+                yield image.convert('RGB')
+
+# censors a stream of frames (e.g. a video) frame by frame with Greedy_Solution (exact_generate)
+# or a Generation class. each frame is warm started from the best permutation of the previous
+# one, so mostly static frames are already close to the goal and only need a few generations
+# (runs stop early through tolerance and patience). decoding, censoring and encoding run at
+# the same time, connected by queues of at most queue_size frames
+class Frame_Stream():
+
+    # constructor takes the percentage of likeness desired, the Generation class to run (None
+    # for exact_generate), the number of individuals, the most generations per frame, whether
+    # individuals are stored as permutations, the margin of error for accepting a frame,
+    # the generations without improvement after which a frame stops and the queues' size
+    def __init__(self, goal, generation_class=None, N=15, iterations=200, permutation=True,
+                 tolerance=.01, patience=20, queue_size=4):
+        self.goal = goal
+        self.generation_class = generation_class
+        self.size = N
+        self.iterations = iterations
+        self.permutation = permutation
+        self.tolerance = tolerance
+        self.patience = patience
+        self.queue_size = queue_size
+
+    # censors one frame given the pixel ids of the previous frame's result (None for the first)
+    # returns the censored pixels, their ids, fitness and the number of generations run
+    def censor(self, frame_num, image, ids):
+        name = f'frame {frame_num:05d}.png'
+        if ids is not None and len(ids) != image.size[0] * image.size[1]:
+            ids = None
+        if self.generation_class is None:
+            solver = Greedy_Solution(name, self.goal, image=image)
+            if ids is not None:
+                solver.apply_ids(ids)
+                solver.evaluate_fitness()
+            if ids is None or solver.fit > self.tolerance:
+                solver.exact_generate()
+                solver.evaluate_fitness()
+            return solver.solution, solver.solution_ids, solver.fit, 0
+        solver = self.generation_class(name, self.size, self.goal, self.permutation, image=image,
+                                       tolerance=self.tolerance, patience=self.patience)
+        solver.generate_population(ids)
+        solver.evaluate_population()
+        generations = 0 if solver.finished() else solver.run(self.iterations)
+        return solver.individual_pixels(solver.best_ind), solver.individual_ids(solver.best_ind).copy(), solver.best_fit, generations
+
+    # censors every frame of frames (an iterable of PIL images, e.g. read_frames) and writes
+    # them to output_folder as 'frame <number>.png' as soon as each one is done
+    # returns the fitness and generations run of every frame
+    def run(self, frames, output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+        decoded = queue.Queue(self.queue_size)
+        encoded = queue.Queue(self.queue_size)
+        # set when any stage fails so the others stop instead of waiting on the queues
+        stop = threading.Event()
+
+        def put(frames_queue, item):
+            while not stop.is_set():
+                try:
+                    frames_queue.put(item, timeout=.1)
+                    return
+                except queue.Full:
+                    pass
+
+        # None once the producer is done (or a stage failed)
+        def get(frames_queue):
+            while not stop.is_set():
+                try:
+                    return frames_queue.get(timeout=.1)
+                except queue.Empty:
+                    pass
+
+        def decode():
+            try:
+                for image in frames:
+                    if stop.is_set(): return
+                    put(decoded, image.convert('RGB'))
+            except BaseException:
+                stop.set()
+                raise
+            put(decoded, None)
+
+        def encode():
+            try:
+                while (item := get(encoded)) is not None:
+                    frame_num, image = item
+                    image.save(f'{output_folder}/frame {frame_num:05d}.png')
+            except BaseException:
+                stop.set()
+                raise
+
+        results = []
+        with ThreadPoolExecutor(2) as pool:
+            decoding = pool.submit(decode)
+            encoding = pool.submit(encode)
+            try:
+                ids = None
+                while (image := get(decoded)) is not None:
+                    pixels, ids, fit, generations = self.censor(len(results), image, ids)
+                    put(encoded, (len(results), Image.fromarray(pixels.reshape((image.size[1], image.size[0], 3)).astype(np.uint8))))
+                    results.append({"frame": len(results), "fitness": float(fit), "generations": generations})
+                put(encoded, None)
+            except BaseException:
+                stop.set()
+                raise
+            # re-raise a failure of the decoder or encoder
+            decoding.result()
+            encoding.result()
+        return results
+
+# barrier shared by the island processes of a pool, set when each worker starts
+island_barrier = None
+
+def init_island(barrier):
+    global island_barrier
+    island_barrier = barrier
+
+# runs one island of an Island_Model in a worker process and returns its best fitness
+# the island's best individual is left in the last row of its block of shared memory
+def run_island(island, settings, iterations, shm_name, migration_name, ind_shape):
+    generation_class, img_file, N, goal, permutation, num_islands, migrate_every, migrants, seed = settings
+    # independent random streams for numpy and the C kernels of this process
+    seed_all(seed, island)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    migration = shared_memory.SharedMemory(name=migration_name)
+    individuals = np.ndarray((num_islands, migrants + 1) + ind_shape, dtype=c_uint, buffer=shm.buf)
+    # number of matching pixels of each migrant
+    migrant_matches = np.ndarray((num_islands, migrants), dtype=c_int, buffer=migration.buf)
+    source = (island - 1) % num_islands
+
+    try:
+        parent = generation_class(img_file, N, goal, permutation)
+        parent.generate_population()
+        parent.evaluate_population()
+        for i in range(iterations):
+            parent.next_generation(i, iterations)
+            if num_islands > 1 and (i + 1) % migrate_every == 0:
+                ranked = np.argsort(parent.fitness[:parent.size], kind='stable')
+                for m in range(migrants):
+                    np.copyto(individuals[island, m], parent.population[ranked[m]])
+                    migrant_matches[island, m] = parent.matches[ranked[m]]
+                island_barrier.wait()
+                for m in range(migrants):
+                    parent.replace_individual(ranked[-1 - m], individuals[source, m], migrant_matches[source, m])
+                # nobody overwrites its migrants until every island has taken its copies
+                island_barrier.wait()
+    except BaseException:
+        # release the other islands waiting for this one at the barrier
+        island_barrier.abort()
+        raise
+    np.copyto(individuals[island, migrants], parent.best_ind)
+    del individuals, migrant_matches
+    shm.close()
+    migration.close()
+    return parent.best_fit
+
+# tiled mode for very large images: the image is decoded once into a np.memmap working file
+# and split into tiles that are censored one at a time (or in parallel) by a Greedy_Solution
+# or a Generation class, each tile with its own sub-goal so the likeness of the whole image
+# still matches goal. results go to a second memmap and are streamed to the output PNG, so
+# the censoring itself only holds tile size x population in memory. the original is still
+# decoded whole once (PIL cannot decode a PNG in row bands), so the constructor's peak
+# memory is that of the decoded image
+class Tiled_Solution():
+    # path to results folder
+    path = ' '
+
+    # constructor takes original image's file, the percentage of likeness desired and the
+    # width/height of a tile. generation_class (EP_Generation or GA_Generation) evolves every
+    # tile with N individuals for iterations generations; if None tiles use exact_generate
+    # working files are kept in workdir (a temporary folder if None)
+    def __init__(self, img_file, goal, tile_size=512, generation_class=None, N=15, iterations=200,
+                 permutation=True, workdir=None, seed=None):
+        self.orig_img_file = img_file
+        self.goal = goal
+        self.tile_size = tile_size
+        self.generation_class = generation_class
+        self.size = N
+        self.iterations = iterations
+        self.permutation = permutation
+        # tile i draws from the streams of worker i of seed
+        self.seed = int(np.random.SeedSequence().entropy % 2**63) if seed is None else seed
+        self.workdir = tempfile.mkdtemp(prefix='tiles ') if workdir is None else workdir
+        os.makedirs(self.workdir, exist_ok=True)
+
+        # decode the original image into the input working file (without a converted copy if
+        # it already is RGB, the decoded image is the peak memory of the whole run)
+        image = Image.open(img_file)
+        if image.mode != 'RGB': image = image.convert('RGB')
+        self.width, self.height = image.size
+        self.num_pixels = self.width * self.height
+        self.input_file = os.path.join(self.workdir, 'input.dat')
+        self.output_file = os.path.join(self.workdir, 'output.dat')
+        # written band by band with plain writes, a memmap would keep every written page resident
+        with open(self.input_file, 'wb') as orig:
+            for top in range(0, self.height, tile_size):
+                orig.write(image.crop((0, top, self.width, min(top + tile_size, self.height))).tobytes())
+        del image
+
+        # tile boxes (left, top, right, bottom)
+        self.tiles = [(left, top, min(left + tile_size, self.width), min(top + tile_size, self.height))
+                      for top in range(0, self.height, tile_size) for left in range(0, self.width, tile_size)]
+        # pixels of every tile to leave in place: round(goal * tile pixels) corrected by the
+        # largest remainders so they add up to exactly round(goal * num_pixels)
+        tile_pixels = np.array([(right - left) * (bottom - top) for left, top, right, bottom in self.tiles])
+        wanted = tile_pixels * goal / 100
+        targets = np.floor(wanted).astype(int)
+        missing = round(goal / 100 * self.num_pixels) - int(targets.sum())
+        targets[np.argsort(targets - wanted, kind='stable')[:missing]] += 1
+        # likeness percentage each tile aims for
+        self.tile_goals = (targets / tile_pixels * 100).tolist()
+
+    # censors every tile, in a pool of workers processes if workers > 1
+    def generate(self, workers=1):
+        np.memmap(self.output_file, dtype=np.uint8, mode='w+', shape=(self.height, self.width, 3)).flush()
+        settings = (self.orig_img_file, self.input_file, self.output_file, (self.height, self.width, 3),
+                    self.generation_class, self.size, self.iterations, self.permutation, self.seed)
+        tasks = [(settings, i, self.tiles[i], self.tile_goals[i]) for i in range(len(self.tiles))]
+        if workers > 1:
+            with mp.Pool(workers) as pool:
+                matches = pool.starmap(censor_tile, tasks)
+        else:
+            matches = [censor_tile(*task) for task in tasks]
+        self.fit = abs(sum(matches) / self.num_pixels * 100 - self.goal)
+
+    # censored image as a read only memmap
+    def result(self):
+        return np.memmap(self.output_file, dtype=np.uint8, mode='r', shape=(self.height, self.width, 3))
 
     def save_result(self):
-        Image.fromarray(np.reshape(self.solution, (self.height, self.width, 3)).astype(np.uint8)).save(f'{self.path}/{self.goal} +- {self.fit:.4f}%.png')
+        save_png_streamed(f'{self.path}/{self.goal} +- {self.fit:.4f}%.png', self.result())
 
     def create_folder_and_save(self, algorithm):
         # create directory for results if one doesnt exist
-        self.path = f"{results_folder}/{self.orig_img_file.replace('./images/', '').replace('.png', ' results')}"
-        if not os.path.exists(self.path): 
-            os.mkdir(self.path)
-        self.path = f"{self.path}/{algorithm}"
-        if not os.path.exists(self.path):
-            os.mkdir(self.path)
-        self.path = f"{self.path}/{self.goal}%"
-        if not os.path.exists(self.path):
-            os.mkdir(self.path)
+        self.path = f"{results_folder}/{os.path.basename(self.orig_img_file).replace('.png', ' results')}/{algorithm}/{self.goal}%"
+        os.makedirs(self.path, exist_ok=True)
         self.save_result()
+
+    # removes the working files
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+# censors one tile of a Tiled_Solution and writes it to the output working file
+# returns the number of pixels of the tile matching the original
+def censor_tile(settings, tile_num, tile, tile_goal):
+    img_file, input_file, output_file, shape, generation_class, N, iterations, permutation, seed = settings
+    seed_all(seed, tile_num)
+    left, top, right, bottom = tile
+    orig = np.memmap(input_file, dtype=np.uint8, mode='r', shape=shape)
+    image = Image.fromarray(np.array(orig[top:bottom, left:right]))
+    del orig
+    if generation_class is None:
+        solver = Greedy_Solution(img_file, tile_goal, image=image)
+        solver.exact_generate()
+        censored = solver.solution
+        orig_pixels = solver.orig_pixels
+    else:
+        solver = generation_class(img_file, N, tile_goal, permutation, image=image)
+        solver.generate_population()
+        solver.evaluate_population()
+        solver.run(iterations)
+        censored = solver.individual_pixels(solver.best_ind)
+        orig_pixels = solver.orig_pixels
+    output = np.memmap(output_file, dtype=np.uint8, mode='r+', shape=shape)
+    output[top:bottom, left:right] = censored.reshape((bottom - top, right - left, 3))
+    output.flush()
+    del output
+    return int(np.all(censored == orig_pixels, axis=1).sum())
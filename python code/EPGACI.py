@@ -1,39 +1,54 @@
 # Evolutionary Programming for Generating Accurately Censored Images
 
-from Container import EP_Generation
-import gc
+from Container import Checkpoint, EP_Generation, Trace_Observer, alert_finished, open_folder
 import os
 import time
-import winsound as ws
 
 # if image too large might crash program (too much memory used)
-# if this is the case screen shot image and use that
+# if this is the case screen shot image and use that, or store
+# individuals as permutations (3x less memory per individual: 4 bytes per pixel instead of 12)
 # image must be a PNG file
 img = "Face.png"
 population_size = 15
 goal_percentage = 25
+permutation     = True
+# a run stops early once its fitness is within tolerance (percentage points) or has not
+# improved in patience generations (None to always run every iteration)
+tolerance       = 0.01
+patience        = 50
+# writes a JSONL trace of every stage of every generation (with cProfile stats per stage if profile)
+trace           = False
+profile         = False
+# checkpoints the run every checkpoint_every generations: a run that was killed resumes from
+# its latest checkpoint when started again (None to never checkpoint)
+checkpoint_every = 10
+# only censors the pixels inside mask: a mask image's file (white inside) or a list of
+# bounding boxes (left, top, right, bottom). None censors the whole image
+mask            = None
 iterations      = 200
 
 print("\nEPGACI started...")
 print("-------------")
 
 # create population container
-parent = EP_Generation(f"./images/{img}", population_size, goal_percentage)
+parent = EP_Generation(f"./images/{img}", population_size, goal_percentage, permutation,
+                       tolerance=tolerance, patience=patience, mask=mask)
+if trace: parent.add_observer(Trace_Observer(f"./alg results/EPGACI trace.jsonl", profile, profile))
 
 start_time = time.perf_counter()
 parent.generate_population()
 parent.evaluate_population()
 
-for i in range(iterations):
-    # mutation
-    parent.generate_children(i, iterations)
-    # survivor selection
-    parent.round_robin(7, 80)
-    parent.sort_wins()
-    parent.survivor_select()
-    if i % 50 == 0: gc.collect()
+checkpoint = None
+if checkpoint_every:
+    checkpoint = Checkpoint(f"./alg results/checkpoints/EPGACI {img} {goal_percentage}%", checkpoint_every)
+# mutation, then survivor selection every generation
+generations = parent.run(iterations, checkpoint)
 
-print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds")
+print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds after {generations} generations")
+for observer in parent.observers: observer.close()
+# the run is complete, it has nothing left to resume
+if checkpoint is not None: checkpoint.remove()
 # parent.create_folder_and_save("EPGACI")
 print(parent.best_fit)
 print("-----------------")
@@ -41,8 +56,7 @@ print(f"Censored images stored in {parent.path}")
 print("------------------")
 print(f"EPGACI completed")
 
-# path = os.path.realpath(parent.path)
-# os.startfile(path)
+# open_folder(parent.path)
 
 # sound to alert user when finished
-ws.Beep(700, 1000)
\ No newline at end of file
+alert_finished()
\ No newline at end of file
@@ -0,0 +1,163 @@
+# Batch edge similarity for Generating Accurately Censored Images
+# runs Canny edge detection on every censored image in alg results/ and censor results/ across
+# a pool of workers and scores how much of the original image's edges each one keeps
+#
+# usage: python "python code/EdgeGACI.py" [--workers N] [--low 100] [--high 200] [--no-maps]
+#                                         [--summary file.csv]
+#
+# scrambled images are read from alg results/<image> results/<algorithm>/<goal>%/ and blurred or
+# pixelated ones from censor results/<method>/<image>/, the original from images/<image>.png
+# every image gets the intersection over union, precision, recall and F1 score of its edge pixels
+# against the original's, and its edge map is written to censor results/Canny Edge Results
+# scores are cached by content hash: an image whose bytes, original and thresholds have not
+# changed is never run through Canny again
+
+from cannyEdge import edge_map, edge_scores, high_threshold, low_threshold, results_folder, save_edges
+import argparse
+import csv
+import cv2
+import glob
+import hashlib
+import json
+import multiprocessing as mp
+import numpy as np
+import os
+import time
+
+edges_folder = f"{results_folder}/Canny Edge Results"
+cache_file   = f"{edges_folder}/edge cache.json"
+
+# edge maps of the originals already computed by a worker: (file, low, high) -> edges
+orig_edges = {}
+
+# cv2 runs single threaded in the workers, the pool already uses every core
+def init_worker():
+    cv2.setNumThreads(1)
+
+# sha256 of a file's contents
+def file_hash(file):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# every censored image found under the result folders as
+# (image name, algorithm or method, goal or None, file, edge map file)
+def find_results():
+    results = []
+    for file in sorted(glob.glob("./alg results/* results/*/*%/*.png")):
+        goal_folder = os.path.dirname(file)
+        algorithm_folder = os.path.dirname(goal_folder)
+        name = os.path.basename(os.path.dirname(algorithm_folder))[:-len(" results")]
+        algorithm = os.path.basename(algorithm_folder)
+        results.append((name, algorithm, os.path.basename(goal_folder)[:-1], file,
+                        f"{edges_folder}/{name}/{algorithm}/{os.path.basename(file)}"))
+    for file in sorted(glob.glob(f"{results_folder}/*/*/*.png")):
+        name_folder = os.path.dirname(file)
+        method = os.path.basename(os.path.dirname(name_folder))
+        if method == os.path.basename(edges_folder): continue
+        name = os.path.basename(name_folder)
+        results.append((name, method, None, file, f"{edges_folder}/{name}/{method}/{os.path.basename(file)}"))
+    return results
+
+# scores one censored image against its original and writes its edge map
+def score_result(job):
+    file, orig_file, edge_file, low, high, write_map = job
+    if (orig_file, low, high) not in orig_edges:
+        orig_edges[(orig_file, low, high)] = edge_map(orig_file, low, high)
+    edges = edge_map(file, low, high)
+    if write_map: save_edges(edge_file, edges)
+    return edge_scores(edges, orig_edges[(orig_file, low, high)])
+
+# loads the score cache: content key -> scores
+def load_cache():
+    if not os.path.exists(cache_file): return {}
+    with open(cache_file) as f:
+        return json.load(f)
+
+# stores the cache through a temporary file so an interrupted run never leaves it truncated
+def save_cache(cache):
+    os.makedirs(edges_folder, exist_ok=True)
+    with open(f"{cache_file}.tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(f"{cache_file}.tmp", cache_file)
+
+# prints rows as an aligned table
+def print_table(rows, columns):
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+# mean scores of every image x algorithm x goal
+def aggregate(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["image"], row["algorithm"], row["goal"]), []).append(row)
+    return [{"image": image, "algorithm": algorithm, "goal": goal, "files": len(group),
+             **{score: round(float(np.mean([row[score] for row in group])), 4) for score in ("iou", "precision", "recall", "f1")}}
+            for (image, algorithm, goal), group in sorted(groups.items(), key=lambda item: tuple(map(str, item[0])))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the edges of every censored image against its original")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--low", type=int, default=low_threshold, help="Canny low threshold")
+    parser.add_argument("--high", type=int, default=high_threshold, help="Canny high threshold")
+    parser.add_argument("--no-maps", action="store_true", help="only compute the scores, do not write edge maps")
+    parser.add_argument("--summary", default=f"{edges_folder}/edge summary.csv", help="CSV file for the per-image scores")
+    args = parser.parse_args()
+
+    print("\nEdgeGACI started...")
+    print("-------------")
+    start_time = time.perf_counter()
+
+    cache = load_cache()
+    rows, jobs, keys = [], [], []
+    orig_hashes = {}
+    for name, algorithm, goal, file, edge_file in find_results():
+        orig_file = f"./images/{name}.png"
+        if not os.path.exists(orig_file):
+            print(f"Skipping {file}: no original {orig_file}")
+            continue
+        if orig_file not in orig_hashes:
+            orig_hashes[orig_file] = file_hash(orig_file)
+            # the originals' own edge maps, as cannyEdge.py saves them
+            if not args.no_maps and not os.path.exists(f"{edges_folder}/{name}/{name}.png"):
+                save_edges(f"{edges_folder}/{name}/{name}.png", edge_map(orig_file, args.low, args.high))
+        key = f"{file_hash(file)}:{orig_hashes[orig_file]}:{args.low}:{args.high}"
+        row = {"image": name, "algorithm": algorithm, "goal": goal if goal is not None else "", "file": file}
+        rows.append(row)
+        if key in cache and (args.no_maps or os.path.exists(edge_file)):
+            row.update(cache[key], cached=True)
+        else:
+            jobs.append((file, orig_file, edge_file, args.low, args.high, not args.no_maps))
+            keys.append((key, row))
+
+    print(f"{len(rows)} images, {len(rows) - len(jobs)} cached, {len(jobs)} to score on {args.workers} workers")
+    if jobs:
+        try:
+            with mp.Pool(args.workers, initializer=init_worker) as pool:
+                # chunks keep each worker on one original so its edge map is computed once per worker
+                for (key, row), scores in zip(keys, pool.imap(score_result, jobs, chunksize=max(1, len(jobs) // (4 * args.workers)))):
+                    cache[key] = scores
+                    row.update(scores, cached=False)
+        finally:
+            # keep whatever was scored even if the run was interrupted
+            save_cache(cache)
+
+    print("-----------------")
+    table = aggregate(rows)
+    if table: print_table(table, ["image", "algorithm", "goal", "files", "iou", "precision", "recall", "f1"])
+    os.makedirs(os.path.dirname(args.summary) or ".", exist_ok=True)
+    with open(args.summary, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["image", "algorithm", "goal", "file", "iou", "precision", "recall", "f1", "cached"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print("------------------")
+    print(f"Scored in {time.perf_counter()-start_time:.3f} seconds")
+    print(f"Summary stored in {args.summary}")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
 # Greedy Solution for Generating Accurately Censored Images
 
-from Container import Greedy_Solution
+from Container import Greedy_Solution, alert_finished, open_folder
 import os
 import time
-import winsound as ws
 
 
 img = "Me.png"
 goal_percentage = 50
+# exact: leave exactly goal % of the pixels in place and derange the rest by color
+exact = True
+# only censors the pixels inside mask: a mask image's file (white inside) or a list of
+# bounding boxes (left, top, right, bottom). None censors the whole image
+mask = None
+# a list of goals censors the image at every one of them in a single pass (with nested fixed
+# pixels: each goal keeps every pixel a lower goal kept) and saves them all. None runs goal_percentage
+goals = None
 
 # used to run GSGACI back to back
 runs = 1
@@ -17,8 +24,18 @@ print("-------------")
 
 for r in range(runs):
     start_time = time.perf_counter()
-    greedy = Greedy_Solution(f"./images/{img}", goal_percentage)
-    greedy.greedy_generate()
+    greedy = Greedy_Solution(f"./images/{img}", goal_percentage, mask=mask)
+    if goals is not None:
+        greedy.multi_generate(goals)
+        print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds")
+        for goal, solution in greedy.goal_solutions.items():
+            print(f"{goal}% fit: {solution.fit}")
+        paths = greedy.create_folders_and_save_goals("GSGACI")
+        greedy.path = os.path.dirname(paths[0])
+        print("-----------------")
+        print(f"Censored images stored in {greedy.path}")
+        continue
+    greedy.exact_generate() if exact else greedy.greedy_generate()
     greedy.evaluate_fitness()
     print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds")
     print(f"Fit: {greedy.fit}")
@@ -28,11 +45,8 @@ for r in range(runs):
     print(f"Censored images stored in {greedy.path}")
     print("------------------")
     print(f"GSGACI completed")
-    # small gap between runs so pseudo random numbers aren't repeated
-    time.sleep(.25)
 
-path = os.path.realpath(greedy.path)
-os.startfile(path)
+open_folder(greedy.path)
 
 # sound to alert user when finished
-ws.Beep(700, 1000)
\ No newline at end of file
+alert_finished()
\ No newline at end of file
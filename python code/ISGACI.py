@@ -0,0 +1,36 @@
+# Island model for Generating Accurately Censored Images
+# runs EPGACI or GAGACI sub-populations on every core and migrates their best individuals
+
+from Container import EP_Generation, GA_Generation, Island_Model
+import os
+import time
+
+# image must be a PNG file
+img = "Face.png"
+algorithm       = EP_Generation
+population_size = 15
+goal_percentage = 25
+permutation     = True
+iterations      = 200
+# islands run in parallel, one per core
+num_islands     = os.cpu_count()
+migrate_every   = 10
+migrants        = 2
+
+if __name__ == '__main__':
+    print("\nISGACI started...")
+    print("-------------")
+
+    islands = Island_Model(algorithm, f"./images/{img}", population_size, goal_percentage, permutation,
+                           num_islands, migrate_every, migrants)
+
+    start_time = time.perf_counter()
+    best_ind, best_fit = islands.run(iterations)
+
+    print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds on {num_islands} islands")
+    # islands.result.create_folder_and_save("EPGACI" if algorithm is EP_Generation else "GAGACI")
+    print(best_fit)
+    print("-----------------")
+    print(f"Censored images stored in {islands.result.path}")
+    print("------------------")
+    print(f"ISGACI completed")
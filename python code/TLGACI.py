@@ -0,0 +1,37 @@
+# Tiled mode for Generating Accurately Censored Images
+# censors very large images tile by tile through memory mapped working files
+
+from Container import EP_Generation, GA_Generation, Tiled_Solution
+import os
+import time
+
+# image must be a PNG file
+img = "Face.png"
+goal_percentage = 25
+tile_size       = 512
+# None censors every tile with the exact greedy generator
+algorithm       = None
+population_size = 15
+permutation     = True
+iterations      = 200
+# tiles are censored in parallel on this many processes
+workers         = os.cpu_count()
+
+if __name__ == '__main__':
+    print("\nTLGACI started...")
+    print("-------------")
+
+    tiled = Tiled_Solution(f"./images/{img}", goal_percentage, tile_size, algorithm, population_size,
+                           iterations, permutation)
+
+    start_time = time.perf_counter()
+    tiled.generate(workers)
+
+    print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds on {len(tiled.tiles)} tiles")
+    tiled.create_folder_and_save("TLGACI")
+    tiled.close()
+    print(tiled.fit)
+    print("-----------------")
+    print(f"Censored image stored in {tiled.path}")
+    print("------------------")
+    print(f"TLGACI completed")
@@ -0,0 +1,40 @@
+# Frame sequences (video) for Generating Accurately Censored Images
+# censors every frame of a folder of frames or an animated image, each frame warm started
+# from the previous one
+
+from Container import EP_Generation, Frame_Stream, alert_finished, read_frames, results_folder
+import os
+import time
+
+# folder of frames (read in file name order) or an animated image such as a GIF
+source          = "./frames"
+goal_percentage = 25
+# None censors every frame with the exact greedy generator
+algorithm       = EP_Generation
+population_size = 15
+permutation     = True
+# most generations per frame, frames stop early once within tolerance or after patience
+# generations without improvement
+iterations      = 200
+tolerance       = 0.01
+patience        = 20
+
+if __name__ == '__main__':
+    print("\nVDGACI started...")
+    print("-------------")
+
+    output_folder = f"{results_folder}/{os.path.basename(os.path.normpath(source))} frames/{goal_percentage}%"
+    stream = Frame_Stream(goal_percentage, algorithm, population_size, iterations, permutation, tolerance, patience)
+
+    start_time = time.perf_counter()
+    for frame in stream.run(read_frames(source), output_folder):
+        print(f"Frame {frame['frame']}: fitness {frame['fitness']:.4f} after {frame['generations']} generations")
+
+    print(f"Run complete in {time.perf_counter()-start_time:.3f} seconds")
+    print("-----------------")
+    print(f"Censored frames stored in {output_folder}")
+    print("------------------")
+    print(f"VDGACI completed")
+
+    # sound to alert user when finished
+    alert_finished()
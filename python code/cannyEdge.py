@@ -1,5 +1,6 @@
-from matplotlib import pyplot as plt
+from Container import open_folder
 import cv2
+import numpy as np
 import os
 
 
@@ -14,50 +15,68 @@ img_file = 'Background.png'
 # use for scrambled images
 # if original image set to None
 # if method != None not used
-algorithm = 'EPGACI' #None 
-percent   = None 
+algorithm = 'EPGACI' #None
+percent   = None
 
 # use for 'Gaussian Blurred' images
 # if neither set to None
 method = 'Gaussian Blurred' #None
 
-if algorithm is not None and percent is not None and method is None:
-    # if scrambled image:
-    img = cv2.imread(f"./alg results/{original_name} results/{algorithm}/{percent}%/{img_file}", cv2.IMREAD_GRAYSCALE)
-    # path = os.path.realpath(f"./results/{original_name} results/{algorithm}/{percent}%/{img_file}")
-    # os.startfile(path)
-elif method is not None:
-    # if blurred or pixelated image
-    img = cv2.imread(f"./censor results/{method}/{original_name}/{img_file}", cv2.IMREAD_GRAYSCALE)
-else:
-    # if original image:
-    img_file = original_image
-    img = cv2.imread(f"./images/{img_file}", cv2.IMREAD_GRAYSCALE)
-
-edges = cv2.Canny(img, 100, 200)
-
-plt.imshow(edges, cmap='gray')
-plt.title(img_file), plt.xticks([]), plt.yticks([])
-
-# create directory for results if one doesn't exist
-if not os.path.exists(results_folder): os.mkdir(results_folder)
-path = f"{results_folder}/Canny Edge Results"
-if not os.path.exists(path): os.mkdir(path)
-path = f"{path}/{original_name}"
-if not os.path.exists(path): os.mkdir(path)
-if algorithm is not None and percent is not None and method is None:
-    path = f"{path}/{algorithm}"
-    if not os.path.exists(path): os.mkdir(path)
-elif method is not None:
-    path = f"{path}/{method}"
-    if not os.path.exists(path): os.mkdir(path)
-
-# saves image
-result_name = f"{path}/{img_file}"
-plt.savefig(result_name)
-
-path = os.path.realpath(path)
-os.startfile(path)
-
-# if image doesn't show remove comment and run
-# plt.show()
\ No newline at end of file
+# Canny hysteresis thresholds
+low_threshold  = 100
+high_threshold = 200
+
+# edge map of an image file as a uint8 array (255 on edges, 0 elsewhere)
+def edge_map(file, low=low_threshold, high=high_threshold):
+    img = cv2.imread(file, cv2.IMREAD_GRAYSCALE)
+    if img is None: raise ValueError(f"could not read {file}")
+    return cv2.Canny(img, low, high)
+
+# overlap of the edges of a censored image with the edges of its original
+# returns the intersection over union, precision, recall and F1 score of the edge pixels
+# (1 where neither image has any edges)
+def edge_scores(edges, orig_edges):
+    edges, orig_edges = edges > 0, orig_edges > 0
+    overlap = int(np.count_nonzero(edges & orig_edges))
+    union = int(np.count_nonzero(edges | orig_edges))
+    found, expected = int(np.count_nonzero(edges)), int(np.count_nonzero(orig_edges))
+    return {"iou": overlap / union if union else 1.0,
+            "precision": overlap / found if found else 1.0,
+            "recall": overlap / expected if expected else 1.0,
+            "f1": 2 * overlap / (found + expected) if found + expected else 1.0}
+
+# writes an edge map as a PNG, creating its folder if needed
+def save_edges(file, edges):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    if not cv2.imwrite(file, edges): raise ValueError(f"could not write {file}")
+
+if __name__ == '__main__':
+    if algorithm is not None and percent is not None and method is None:
+        # if scrambled image:
+        file = f"./alg results/{original_name} results/{algorithm}/{percent}%/{img_file}"
+        # path = os.path.realpath(f"./results/{original_name} results/{algorithm}/{percent}%/{img_file}")
+        # os.startfile(path)
+    elif method is not None:
+        # if blurred or pixelated image
+        file = f"./censor results/{method}/{original_name}/{img_file}"
+    else:
+        # if original image:
+        img_file = original_image
+        file = f"./images/{img_file}"
+
+    edges = edge_map(file)
+    if file != f"./images/{original_image}":
+        print(edge_scores(edges, edge_map(f"./images/{original_image}")))
+
+    # create directory for results if one doesn't exist
+    path = f"{results_folder}/Canny Edge Results/{original_name}"
+    if algorithm is not None and percent is not None and method is None:
+        path = f"{path}/{algorithm}"
+    elif method is not None:
+        path = f"{path}/{method}"
+
+    # saves image
+    result_name = f"{path}/{img_file}"
+    save_edges(result_name, edges)
+
+    open_folder(path)